@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from fortune import Voronoi
+from sampling import uniform, bounds
+
+
+# batch generation of diagrams from a job file, one json object per line:
+#
+#   {"seed": 1, "sites": 5000, "box": [[0, 0], [800, 0], [800, 600], [0, 600]], "format": "npz"}
+#
+# box is optional (Voronoi's default box), name defaults to the job's line
+# number and format is one of FORMATS. jobs run in a process pool with at
+# most a few per worker in flight, so a job file of any length never queues
+# more than that, and each finished job is written to --out as it arrives.
+# workers only import the geometry, PIL is loaded by the first png job
+#
+#   python batch.py jobs.jsonl --out maps --workers 8
+
+FORMATS = ('npz', 'json', 'png')
+
+
+def read_jobs(path):
+    with open(path) as f:
+        for k, line in enumerate(f):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            job = json.loads(line)
+            job.setdefault('name', 'job%06d' % k)
+            job.setdefault('seed', k)
+            job.setdefault('box', None)
+            job.setdefault('format', 'npz')
+            if job['format'] not in FORMATS:
+                raise ValueError("line %d: unknown format %r" % (k + 1, job['format']))
+            if 'sites' not in job:
+                raise ValueError("line %d: no site count" % (k + 1))
+            yield job
+
+
+def run_job(job, out):
+    # builds one diagram and writes it to out/name.format, returns (name,
+    # sites, seconds)
+    start = time.perf_counter()
+    box = job['box']
+    sites = uniform(job['sites'], box, seed=job['seed'])
+    v = Voronoi(sites, box)
+    v.bind()
+    v.assignLines()
+    path = os.path.join(out, job['name'] + '.' + job['format'])
+    if job['format'] == 'png':
+        region, lo, hi = bounds(box)
+        w, h = np.ceil(hi).astype(int)
+        v.image(int(w), int(h), seed=job['seed']).save(path)
+    else:
+        arrays = v.to_diagram().arrays()
+        if job['format'] == 'npz':
+            np.savez(path, **arrays)
+        else:
+            with open(path, 'w') as f:
+                json.dump({k: a.tolist() for k, a in arrays.items()}, f)
+    return job['name'], len(sites), time.perf_counter() - start
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='generate Voronoi diagrams from a job file')
+    ap.add_argument('jobs', help='job file, one json object per line')
+    ap.add_argument('--out', default='out')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    ap.add_argument('--inflight', type=int, default=2, help='jobs in flight per worker')
+    args = ap.parse_args(argv)
+    os.makedirs(args.out, exist_ok=True)
+
+    start = time.perf_counter()
+    done = 0
+    total_sites = 0
+
+    def report(name, n, t):
+        nonlocal done, total_sites
+        done += 1
+        total_sites += n
+        el = time.perf_counter() - start
+        print('%s %d sites %.3fs | %d jobs %.1f jobs/s %.0f sites/s' % (name, n, t, done, done / el, total_sites / el), flush=True)
+
+    if args.workers <= 1:
+        for job in read_jobs(args.jobs):
+            report(*run_job(job, args.out))
+    else:
+        with ProcessPoolExecutor(args.workers) as pool:
+            pending = set()
+            for job in read_jobs(args.jobs):
+                if len(pending) >= args.workers * args.inflight:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in finished:
+                        report(*f.result())
+                pending.add(pool.submit(run_job, job, args.out))
+            for f in wait(pending)[0]:
+                report(*f.result())
+    el = time.perf_counter() - start
+    print('%d jobs, %d sites in %.2fs: %.1f jobs/s, %.0f sites/s' % (done, total_sites, el, done / max(el, 1e-9), total_sites / max(el, 1e-9)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
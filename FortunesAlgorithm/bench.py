@@ -0,0 +1,134 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from fortune import Voronoi
+
+
+# benchmark of every stage of the pipeline: the sweep (Voronoi construction),
+# bind, assignLines (which orders the cells) and rendering a label image.
+# each stage is timed on its own, then run again under tracemalloc for its
+# peak memory, since tracing slows everything down. results go to a json
+# file, one record per (size, distribution, box, stage)
+#
+#   python bench.py --sizes 100 1000 10000 --out bench.json
+
+SIZE = 500.0
+
+BOXES = {
+    'square': None,
+    'concave': [(0, 0), (SIZE, 0), (SIZE, SIZE), (SIZE / 2, SIZE * 0.4), (0, SIZE)],
+    'notched': [(0, 0), (SIZE * 0.6, 0), (SIZE * 0.6, SIZE * 0.4), (SIZE, SIZE * 0.4), (SIZE, SIZE), (0, SIZE)],
+}
+
+
+def uniform(rng, n):
+    return rng.uniform(0, SIZE, (n, 2))
+
+
+def clustered(rng, n):
+    # gaussian blobs of about 200 sites each
+    k = max(1, n // 200)
+    centres = rng.uniform(0, SIZE, (k, 2))
+    pts = centres[rng.integers(0, k, n)] + rng.normal(0, SIZE / (4 * np.sqrt(k)), (n, 2))
+    return np.clip(pts, 0, SIZE)
+
+
+def jittered(rng, n):
+    # one site per cell of a square grid, moved up to a quarter cell
+    side = int(np.ceil(np.sqrt(n)))
+    h = SIZE / side
+    g = np.stack(np.meshgrid(np.arange(side), np.arange(side)), -1).reshape(-1, 2)[:n]
+    return (g + 0.5 + rng.uniform(-0.25, 0.25, (n, 2))) * h
+
+
+def shared_x(rng, n):
+    # columns of sites on a few hundred x values
+    xs = np.linspace(0, SIZE, max(2, int(np.sqrt(n))))
+    return np.column_stack((rng.choice(xs, n), rng.uniform(0, SIZE, n)))
+
+
+DISTS = {'uniform': uniform, 'clustered': clustered, 'jittered': jittered, 'shared_x': shared_x}
+
+
+def sites(dist, n, seed):
+    pts = DISTS[dist](np.random.default_rng(seed), n)
+    # the sweep expects distinct sites
+    return np.unique(pts, axis=0)
+
+
+def stages(pts, box, render):
+    # the pipeline as a list of (name, callable), each building on the last
+    state = {}
+
+    def sweep():
+        state['v'] = Voronoi(pts, box)
+
+    def bind():
+        state['v'].bind()
+
+    def assign():
+        state['v'].assignLines()
+
+    def raster():
+        state['v'].label_image(render, render, extent=(0, SIZE, 0, SIZE))
+
+    out = [('sweep', sweep), ('bind', bind), ('assign', assign)]
+    if render:
+        out.append(('render', raster))
+    return out
+
+
+def run(pts, box, render, memory):
+    # seconds per stage and, if memory, peak traced bytes per stage
+    times = {}
+    for name, f in stages(pts, box, render):
+        t = time.perf_counter()
+        f()
+        times[name] = time.perf_counter() - t
+    peaks = {}
+    if memory:
+        for name, f in stages(pts, box, render):
+            tracemalloc.start()
+            f()
+            peaks[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return times, peaks
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='time and measure every stage of the Voronoi pipeline')
+    ap.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000, 1000000])
+    ap.add_argument('--dists', nargs='+', default=list(DISTS), choices=list(DISTS))
+    ap.add_argument('--boxes', nargs='+', default=list(BOXES), choices=list(BOXES))
+    ap.add_argument('--render', type=int, default=1024, help='label image side in pixels, 0 to skip')
+    ap.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--out', default='bench.json')
+    args = ap.parse_args(argv)
+
+    results = []
+    for n in args.sizes:
+        for dist in args.dists:
+            pts = sites(dist, n, args.seed)
+            for box in args.boxes:
+                times, peaks = run(pts, BOXES[box], args.render, not args.no_memory)
+                for stage in times:
+                    results.append({'n': n, 'sites': len(pts), 'dist': dist, 'box': box, 'stage': stage,
+                                    'time': times[stage], 'peak': peaks.get(stage)})
+                print(n, dist, box, ' '.join('%s %.3fs' % i for i in times.items()), flush=True)
+                # each run is written as it completes, a long suite can be stopped
+                with open(args.out, 'w') as f:
+                    json.dump({'meta': meta(args), 'results': results}, f, indent=1)
+
+
+def meta(args):
+    return {'python': sys.version.split()[0], 'numpy': np.__version__, 'platform': platform.platform(),
+            'seed': args.seed, 'render': args.render, 'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+if __name__ == '__main__':
+    main()
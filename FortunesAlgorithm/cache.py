@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+import numpy as np
+from fortune import Voronoi
+from diagram import Diagram
+
+
+# on-disk cache of finished diagrams, keyed by a hash of everything that goes
+# into one. an entry is a Diagram saved in its raw format and loaded back
+# memory mapped, so a hit only costs the reads the caller makes. entries are
+# written under a temporary name and renamed into place, which is atomic, so
+# several processes can share a cache; a second writer of the same key just
+# replaces the first with the same bytes. entry mtimes are the LRU order, a
+# hit touches its entry
+
+VERSION = 2
+SUFFIX = '.diagram'
+
+
+def diagram_key(sites, bounding_box=None, **options):
+    # hex digest of the sites, the bounding polygon and any options
+    h = hashlib.sha256()
+    h.update(b'voronoi %d\0' % VERSION)
+    sites = np.ascontiguousarray(sites, dtype=np.float64).reshape(-1, 2)
+    h.update(b'%d\0' % len(sites))
+    h.update(sites.tobytes())
+    box = np.zeros((0, 2)) if bounding_box is None else np.ascontiguousarray(bounding_box, dtype=np.float64).reshape(-1, 2)
+    h.update(b'%d\0' % len(box))
+    h.update(box.tobytes())
+    h.update(json.dumps(options, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+class DiagramCache():
+    def __init__(self, path, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def entry(self, key):
+        return os.path.join(self.path, key + SUFFIX)
+
+    def get(self, key):
+        # the Diagram stored under key, memory mapped, or None
+        path = self.entry(key)
+        try:
+            d = Diagram.load(path)
+            os.utime(path)
+        except FileNotFoundError:
+            # missing, or evicted by another process while we read it
+            return None
+        return d
+
+    def put(self, key, diagram):
+        # stores diagram under key, then evicts down to size
+        tmp = os.path.join(self.path, '.tmp-' + uuid.uuid4().hex)
+        try:
+            diagram.save(tmp)
+            os.replace(tmp, self.entry(key))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+
+    def evict(self):
+        # drops least recently used entries until the cache fits max_bytes.
+        # temporary files from writers that died are cleared after an hour
+        entries = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+                if name.startswith('.tmp-'):
+                    if now - st.st_mtime > 3600:
+                        os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if name.endswith(SUFFIX):
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def diagram(self, sites, bounding_box=None, **options):
+        # the Diagram of the sites, from the cache when it has it
+        key = diagram_key(sites, bounding_box, **options)
+        res = self.get(key)
+        if res is None:
+            v = Voronoi(sites, bounding_box)
+            v.bind()
+            v.assignLines(**options)
+            res = v.to_diagram()
+            self.put(key, res)
+        return res
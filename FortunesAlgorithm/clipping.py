@@ -0,0 +1,173 @@
+import numpy as np
+from region import Region
+
+
+# clipping of many segments against one boundary polygon in a single pass.
+# segments are [E,4] arrays of (x0, y0, x1, y1). the result keeps, for every
+# piece of a segment inside the polygon, the segment it came from and its
+# parametric range, plus the polygon sides split wherever segments cross them
+
+
+# how far from a side, relative to the polygon's size, a segment end still
+# counts as on it
+SNAP = 2.0 ** -40
+
+
+def is_rect(poly):
+    # axis aligned rectangle given as 4 corners in order
+    if len(poly) != 4:
+        return False
+    for k in range(4):
+        a = poly[k]
+        b = poly[(k+1) % 4]
+        if a[0] != b[0] and a[1] != b[1]:
+            return False
+    xs = set(p[0] for p in poly)
+    ys = set(p[1] for p in poly)
+    return len(xs) == 2 and len(ys) == 2
+
+
+def liang_barsky(edges, x0, y0, x1, y1):
+    # parametric range [t0, t1] of each segment inside the rectangle
+    dx = edges[:, 2] - edges[:, 0]
+    dy = edges[:, 3] - edges[:, 1]
+    t0 = np.zeros(len(edges))
+    t1 = np.ones(len(edges))
+    keep = np.ones(len(edges), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for p, q in ((-dx, edges[:, 0] - x0), (dx, x1 - edges[:, 0]),
+                     (-dy, edges[:, 1] - y0), (dy, y1 - edges[:, 1])):
+            keep &= (p != 0) | (q >= 0)
+            r = q / p
+            t0 = np.where(p < 0, np.maximum(t0, r), t0)
+            t1 = np.where(p > 0, np.minimum(t1, r), t1)
+    keep &= t0 <= t1
+    return t0, t1, keep
+
+
+def crossings(edges, poly, chunk=1 << 22):
+    # every crossing of a segment with a polygon side, as (edge, t, side, u)
+    # with t along the segment and u along the side. u is half open so a
+    # segment through a polygon corner is counted once. a segment end within
+    # a rounding error of a side (SNAP of the polygon's size), as the ends of
+    # a diagram already clipped to it are, crosses it at exactly t = 0 or 1
+    poly = np.asarray(poly, dtype=np.float64)
+    c = poly
+    d = np.roll(poly, -1, axis=0)
+    sx = d[:, 0] - c[:, 0]
+    sy = d[:, 1] - c[:, 1]
+    tol = SNAP * np.abs(poly).max() if len(poly) else 0.0
+    step = max(1, chunk // max(len(poly), 1))
+    out = []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for s in range(0, len(edges), step):
+            e = edges[s:s + step]
+            ex = (e[:, 2] - e[:, 0])[:, None]
+            ey = (e[:, 3] - e[:, 1])[:, None]
+            ax = c[None, :, 0] - e[:, 0, None]
+            ay = c[None, :, 1] - e[:, 1, None]
+            den = ex * sy - ey * sx
+            t = (ax * sy - ay * sx) / den
+            u = (ax * ey - ay * ex) / den
+            near = tol / np.hypot(ex, ey)
+            t = np.where(np.abs(t) <= near, 0.0, np.where(np.abs(t - 1) <= near, 1.0, t))
+            hit = (den != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u < 1)
+            ei, si = np.nonzero(hit)
+            out.append((ei + s, t[ei, si], si, u[ei, si]))
+    if len(out) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return tuple(np.concatenate(i) for i in zip(*out))
+
+
+def at(edges, idx, t):
+    # points at parameter t along edges[idx]. both clipped pieces and split
+    # polygon sides use this, so shared points compare equal
+    e = edges[idx]
+    p = e[:, :2] + t[:, None] * (e[:, 2:] - e[:, :2])
+    return np.where((t == 1)[:, None], e[:, 2:], p)
+
+
+def rect_crossings(edges, t0, t1, keep, poly):
+    # the boundary points of Liang-Barsky pieces, as (side, u, point) on poly.
+    # besides the cuts, segment ends lying on the rectangle (to within SNAP)
+    # count, as for a diagram that was already clipped to it
+    poly = np.asarray(poly, dtype=np.float64)
+    xs = (poly[:, 0].min(), poly[:, 0].max())
+    ys = (poly[:, 1].min(), poly[:, 1].max())
+    tol = SNAP * np.abs(poly).max()
+    pts = []
+    for t, end, whole in ((t0, edges[:, :2], 0), (t1, edges[:, 2:], 1)):
+        m = np.flatnonzero(keep & (t > 0) & (t < 1))
+        pts.append(at(edges, m, t[m]))
+        on = ((np.abs(end[:, 0] - xs[0]) <= tol) | (np.abs(end[:, 0] - xs[1]) <= tol) |
+              (np.abs(end[:, 1] - ys[0]) <= tol) | (np.abs(end[:, 1] - ys[1]) <= tol))
+        pts.append(end[keep & (t == whole) & on])
+    pts = np.concatenate(pts)
+    c = poly
+    d = np.roll(poly, -1, axis=0)
+    # nearest side of the rectangle, and position along it
+    dist = np.empty((len(pts), 4))
+    u = np.empty((len(pts), 4))
+    for k in range(4):
+        v = d[k] - c[k]
+        w = np.clip((pts - c[k]) @ v / (v @ v), 0, 1)
+        dist[:, k] = ((c[k] + w[:, None] * v - pts) ** 2).sum(1)
+        u[:, k] = w
+    side = dist.argmin(1)
+    return side, u[np.arange(len(pts)), side], pts
+
+
+def clip_edges(edges, poly, region=None):
+    # returns (piece_edge, t0, t1) for the pieces of edges inside poly and the
+    # polygon sides split at every crossing as a [B,4] array. region is an
+    # already built Region for poly, if the caller has one
+    edges = np.asarray(edges, dtype=np.float64).reshape(-1, 4)
+    if is_rect(poly):
+        xs = [p[0] for p in poly]
+        ys = [p[1] for p in poly]
+        t0, t1, keep = liang_barsky(edges, min(xs), min(ys), max(xs), max(ys))
+        pe = np.flatnonzero(keep)
+        return (pe, t0[pe], t1[pe]) + (split_sides(poly, *rect_crossings(edges, t0, t1, keep, poly)),)
+
+    ei, t, si, u = crossings(edges, poly)
+    # cut every segment at its crossings, then keep the intervals whose
+    # midpoint is inside
+    n = len(edges)
+    ev = np.concatenate((np.arange(n), np.arange(n), ei))
+    tv = np.concatenate((np.zeros(n), np.ones(n), t))
+    o = np.lexsort((tv, ev))
+    ev = ev[o]
+    tv = tv[o]
+    same = ev[1:] == ev[:-1]
+    pe = ev[:-1][same]
+    t0 = tv[:-1][same]
+    t1 = tv[1:][same]
+    m = t1 > t0
+    pe, t0, t1 = pe[m], t0[m], t1[m]
+    mid = edges[pe, :2] + ((t0 + t1) / 2)[:, None] * (edges[pe, 2:] - edges[pe, :2])
+    if region is None:
+        region = Region(poly)
+    m = region.contains(mid)
+    return pe[m], t0[m], t1[m], split_sides(poly, si, u, at(edges, ei, t))
+
+
+def split_sides(poly, side, u, pts):
+    # polygon sides cut at the given points, (side, u) placing each one, as
+    # an [B,4] array in polygon order
+    poly = np.asarray(poly, dtype=np.float64)
+    m = len(poly)
+    nxt = np.roll(poly, -1, axis=0)
+    sv = np.concatenate((np.arange(m), np.arange(m), side))
+    uv = np.concatenate((np.zeros(m), np.ones(m), u))
+    pv = np.concatenate((poly, nxt, pts.reshape(-1, 2)))
+    o = np.lexsort((uv, sv))
+    sv = sv[o]
+    uv = uv[o]
+    pv = pv[o]
+    same = (sv[1:] == sv[:-1]) & np.any(pv[1:] != pv[:-1], axis=1)
+    return np.hstack((pv[:-1][same], pv[1:][same]))
+
+
+def pieces(edges, pe, t0, t1):
+    # coordinates of clipped pieces as an [P,4] array
+    return np.hstack((at(edges, pe, t0), at(edges, pe, t1)))
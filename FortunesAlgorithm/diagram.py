@@ -0,0 +1,125 @@
+import json
+import numpy as np
+
+
+# struct of arrays form of a finished diagram. every vertex is stored once,
+# segments and cells refer to it by index, and the cells are flat loops with
+# offsets, so a diagram is seven arrays and no python objects. it saves to a
+# raw file (a json header, then each array's bytes 64-byte aligned) that
+# loads back memory mapped, and pickles with protocol 5 with the arrays as
+# out-of-band buffers:
+#
+#   buffers = []
+#   data = pickle.dumps(d, protocol=5, buffer_callback=buffers.append)
+#   d = pickle.loads(data, buffers=buffers)
+
+MAGIC = b'VORONOI\0'
+VERSION = 1
+ALIGN = 64
+
+FIELDS = ('sites', 'vertices', 'edges', 'edge_sites', 'cell_rows', 'cell_indptr', 'cell_vertices')
+
+
+class Diagram():
+    # sites [N,2] float64 and vertices [V,2] float64. edges [E,2] int32 index
+    # vertices, edge_sites [E,2] int32 the rows of sites either side. cell i
+    # belongs to site cell_rows[i] and runs through
+    # vertices[cell_vertices[cell_indptr[i]:cell_indptr[i+1]]], without
+    # repeating its first vertex. a cell a concave region cuts in pieces has
+    # one entry per piece
+    def __init__(self, sites, vertices, edges, edge_sites, cell_rows, cell_indptr, cell_vertices):
+        self.sites = sites
+        self.vertices = vertices
+        self.edges = edges
+        self.edge_sites = edge_sites
+        self.cell_rows = cell_rows
+        self.cell_indptr = cell_indptr
+        self.cell_vertices = cell_vertices
+
+    @classmethod
+    def from_voronoi(cls, v):
+        # binds and assigns v first if that wasn't done
+        if v.verts is None:
+            v.bind()
+            v.assignLines()
+        ends, edges, edge_sites = v.output_arrays()
+        rows, indptr, xy = v.polygon_arrays()
+        # drop the closing repeat of each cell's first vertex
+        counts = np.diff(indptr)
+        loop = np.flatnonzero(counts > 1)
+        closed = np.zeros(len(counts), dtype=bool)
+        closed[loop] = (xy[indptr[loop]] == xy[indptr[loop + 1] - 1]).all(1)
+        keep = np.ones(len(xy), dtype=bool)
+        keep[indptr[1:][closed] - 1] = False
+        xy = xy[keep]
+        counts = counts - closed
+        # one table for segment ends and cell corners, matched exactly
+        pts = np.vstack((ends, xy))
+        o = np.lexsort((pts[:, 1], pts[:, 0]))
+        new = np.ones(len(pts), dtype=bool)
+        new[1:] = (pts[o][1:] != pts[o][:-1]).any(1)
+        inv = np.empty(len(pts), dtype=np.int32)
+        inv[o] = np.cumsum(new) - 1
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(np.array(v.sites, dtype=np.float64), pts[o][new], inv[:len(ends)][edges],
+                   edge_sites.astype(np.int32), rows.astype(np.int32), indptr, inv[len(ends):])
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in FIELDS}
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays().values())
+
+    def polygon(self, i):
+        # [K,2] vertices of cell i
+        return self.vertices[self.cell_vertices[self.cell_indptr[i]:self.cell_indptr[i + 1]]]
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(header(self.arrays()))
+            for a in self.arrays().values():
+                a = np.ascontiguousarray(a)
+                f.write(a.tobytes())
+                f.write(b'\0' * (-a.nbytes % ALIGN))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        # the arrays are read-only views of the file when mmap
+        with open(path, 'rb') as f:
+            fields, start = read_header(f)
+        buf = np.memmap(path, dtype=np.uint8, mode='r') if mmap else np.fromfile(path, dtype=np.uint8)
+        arrays = {}
+        for name, dtype, shape in fields:
+            n = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            arrays[name] = buf[start:start + n].view(dtype).reshape(shape)
+            start += n + (-n % ALIGN)
+        return cls(**arrays)
+
+    def __getstate__(self):
+        # plain arrays, which protocol 5 hands to buffer_callback
+        return {name: np.ascontiguousarray(a) for name, a in self.arrays().items()}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+def header(arrays):
+    # magic, version, header length, then the json field list, padded so the
+    # first array starts aligned
+    fields = [(name, np.asarray(a).dtype.str, list(np.shape(a))) for name, a in arrays.items()]
+    body = json.dumps(fields).encode()
+    size = len(MAGIC) + 8 + len(body)
+    body += b' ' * (-size % ALIGN)
+    return MAGIC + np.array([VERSION, len(body)], dtype='<u4').tobytes() + body
+
+
+def read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a saved diagram")
+    version, size = np.frombuffer(f.read(8), dtype='<u4')
+    if version != VERSION:
+        raise ValueError("unsupported diagram version %d" % version)
+    fields = json.loads(f.read(int(size)))
+    return [(name, dtype, tuple(shape)) for name, dtype, shape in fields], len(MAGIC) + 8 + int(size)
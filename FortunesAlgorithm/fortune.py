@@ -1,44 +1,72 @@
+import os
 import random
-from PIL import Image, ImageDraw
 import heapq
 from dataclasses import dataclass, field
 import math
-
+import time
+import functools
+import numpy as np
+from spatial import SiteIndex, SiteGrid
+from clipping import clip_edges, pieces
+from region import Region
+from predicates import orient, circumcenter, circle_x, breakpoint_y
+from raster import label_image, colorize
+from masks import MaskClipper
+from diagram import Diagram
+
+
+def timed(f):
+    # adds the method's run time to stats['time'] when stats are on
+    name = f.__name__
+    @functools.wraps(f)
+    def wrapper(self, *args, **kwargs):
+        if self.stats is None:
+            return f(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return f(self, *args, **kwargs)
+        finally:
+            times = self.stats['time']
+            times[name] = times.get(name, 0.0) + time.perf_counter() - start
+    return wrapper
 
 class Voronoi():
-    def __init__(self, points, bounding_box = None):
-        self.lines = []
-        self.arc_tree = None
-
+    def __init__(self, points, bounding_box = None, stream=False, emit=None, clip=False, stats=False, hook=None, sweep=True):
         # Creates bounding box if none given
-        if bounding_box == None:
+        if bounding_box is None:
             self.x0 = 0
             self.x1 = 500
             self.y0 = 0
             self.y1 = 500
             self.box_vert = [(self.x0, self.y0), (self.x0, self.y1), (self.x1, self.y1), (self.x1, self.y0)]
         else:
-            self.x0 = min(bounding_box, key=lambda x: x[0])[0]
-            self.x1 = max(bounding_box, key=lambda x: x[0])[0]
-            self.y0 = min(bounding_box, key=lambda x: x[1])[1]
-            self.y1 = max(bounding_box, key=lambda x: x[1])[1]
-            self.box_vert = bounding_box
+            # a list of pairs or an [M,2] array, kept as tuples of floats
+            self.box_vert = [tuple(v) for v in np.asarray(bounding_box).tolist()]
+            self.x0 = min(v[0] for v in self.box_vert)
+            self.x1 = max(v[0] for v in self.box_vert)
+            self.y0 = min(v[1] for v in self.box_vert)
+            self.y1 = max(v[1] for v in self.box_vert)
             # self.x0 = bounding_box[0]
             # self.x1 = bounding_box[1]
             # self.y0 = bounding_box[2]
             # self.y1 = bounding_box[3]
         
-        self.box_lines = [self.box_vert[i]+self.box_vert[i+1] if i < len(self.box_vert)-1 else self.box_vert[i]+self.box_vert[0] for i in range(len(self.box_vert))]
-        # adds points to "priority queue", points should have no duplicates
-        self.points = []
-        for p in points:
-            new_point = Point(p[0], p[1])
-            # if new_point.x > self.x0 and new_point.x < self.x1 and new_point.y > self.y0 and new_point.y < self.y1:
-            if not self.isOutside(new_point.x, new_point.y):
-                heapq.heappush(self.points, new_point)
-        self.points_used = []
-        for i in self.points:
-            self.points_used.append(i)
+        self.region = Region(self.box_vert)
+        # sites keeps every input row so site indices match the caller's array,
+        # it is a copy since relax moves the sites in place
+        if not isinstance(points, np.ndarray):
+            points = list(points)
+        self.sites = np.array(points, dtype=np.float64).reshape(-1, 2)
+        # streaming mode keeps no finished edges or topology, they are handed
+        # out by edges() (or to emit) as the sweep completes them
+        self.stream = stream or emit is not None
+        self.emit = emit
+        self.clip = clip
+        # instrumentation is off unless asked for, see new_stats. hook is
+        # called as hook(kind, x, y, payload) for every event swept, kind
+        # being 'site' or 'circle'
+        self.stats = {} if stats else None
+        self.hook = hook
 
             # if new_point.x < self.x0: self.x0 = new_point.x
             # if new_point.y < self.y0: self.y0 = new_point.y
@@ -52,86 +80,303 @@ class Voronoi():
         # self.y0 = self.y0 - dy
         # self.y1 = self.y1 + dy
 
-        self.process()
+        self.build(sweep)
+
+    def build(self, sweep=True):
+        # (re)runs the sweep over self.sites, dropping any earlier diagram.
+        # sweep=False sets up the sites and leaves the event queue empty,
+        # for load_cells
+        self.lines = []
+        # every segment of the sweep, self.lines is replaced by bind
+        self.swept = self.lines
+        self.heads = None
+        self.arc_tree = BeachLine()
+        self.index = None
+        self.box_owner = None
+        self.cells = None
+        self.verts = None
+        self.sweep_x = 0
+        self.segments = 0
+        # site rows of each delaunay triangle, three at a time, one triangle
+        # per circle event
+        self.tri = []
+        # edit state, see dynamic
+        self.adjacency = None
+        self.site_buf = None
+        # why the half-edges and triangles can't be used, if they can't
+        self.no_topology = "streaming mode keeps none" if self.stream else None
+        if self.stats is not None:
+            self.stats = self.new_stats()
+        self.box_lines = [self.box_vert[i]+self.box_vert[i+1] if i < len(self.box_vert)-1 else self.box_vert[i]+self.box_vert[0] for i in range(len(self.box_vert))]
 
+        # adds points to the event queue, points should have no duplicates
+        keep = np.flatnonzero(self.insideMask(self.sites))
+        xs = self.sites[keep, 0].tolist()
+        ys = self.sites[keep, 1].tolist()
+        self.points_used = [Point(x, y, i) for x, y, i in zip(xs, ys, keep.tolist())]
+        self.events = EventQueue(self.points_used if sweep else ())
+        self.finished = []
+        if not sweep:
+            return
+        if self.emit is not None:
+            for e in self.edges():
+                self.emit(e)
+        elif not self.stream:
+            self.process()
+
+    @classmethod
+    def from_array(cls, sites, bounding_box = None):
+        # sites is an [N,2] array, edge_sites from output_arrays index its rows
+        sites = np.asarray(sites, dtype=np.float64)
+        if sites.ndim != 2 or sites.shape[1] != 2:
+            raise ValueError("sites must be an array of shape (N, 2)")
+        return cls(sites, bounding_box)
+
+    @classmethod
+    def parallel(cls, points, bounding_box=None, workers=None, strips=None):
+        # the bound and assigned diagram built from vertical strips of sites,
+        # each swept in a worker process with a halo of its neighbours and
+        # kept only where it is certified exact, see tiles.py. the stitched
+        # cells are then loaded with load_cells so the usual accessors work
+        from tiles import tiled_cells
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if strips is None:
+            strips = workers
+        v = cls(points, bounding_box, sweep=False)
+        v.load_cells(*tiled_cells(v.sites, v.box_vert, (strips, 1), workers))
+        return v
+
+    def load_cells(self, vertices, rows, indptr, indices):
+        # fills lines, box_lines, cells and verts from cells given as loops of
+        # vertex indices, as tiled_cells returns them. a side two cells share
+        # becomes a segment between their sites, a side of only one cell is a
+        # piece of the box. half-edges and delaunay triangles are not rebuilt,
+        # neighbors() and delaunay_triangles() raise (neighbor_arrays works)
+        self.no_topology = "load_cells doesn't rebuild them"
+        pts = [Point(x, y) for x, y in np.asarray(vertices, dtype=np.float64).tolist()]
+        pos = np.full(len(self.sites), -1, dtype=np.int64)
+        pos[[p.index for p in self.points_used]] = np.arange(len(self.points_used))
+        counts = np.diff(indptr)
+        cell = np.repeat(np.arange(len(rows)), counts)
+        # side k runs from vertex a[k] to b[k], the last one closing the loop
+        nxt = np.arange(1, len(indices) + 1)
+        nxt[indptr[1:][counts > 0] - 1] = indptr[:-1][counts > 0]
+        a = np.asarray(indices)
+        b = a[nxt]
+        lo = np.minimum(a, b)
+        hi = np.maximum(a, b)
+        o = np.lexsort((hi, lo))
+        same = np.flatnonzero((lo[o][1:] == lo[o][:-1]) & (hi[o][1:] == hi[o][:-1]))
+        shared = np.zeros(len(a), dtype=bool)
+        shared[o[same]] = True
+        shared[o[same + 1]] = True
+        owner = pos[np.asarray(rows)[cell]].tolist()
+
+        used = self.points_used
+        self.lines = []
+        k = o[same]
+        j = o[same + 1]
+        for s, e, p0, p1 in zip(a[k].tolist(), b[k].tolist(), k.tolist(), j.tolist()):
+            seg = ArcSegment(pts[s], used[owner[p0]], used[owner[p1]], False)
+            seg.Finish(pts[e])
+            self.lines.append(seg)
+        box = np.flatnonzero(~shared)
+        self.box_lines = [(pts[i].x, pts[i].y, pts[j].x, pts[j].y) for i, j in zip(a[box].tolist(), b[box].tolist())]
+        self.box_owner = np.array(owner, dtype=np.int64)[box]
+
+        self.cells = {(p.x, p.y): [] for p in used}
+        self.verts = {(p.x, p.y): [] for p in used}
+        vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+        sides = list(map(tuple, np.hstack((vertices[a], vertices[b])).tolist()))
+        ends = list(map(tuple, vertices[b].tolist()))
+        pos = pos.tolist()
+        for c, s, e in zip(np.asarray(rows).tolist(), indptr[:-1].tolist(), indptr[1:].tolist()):
+            if s == e:
+                continue
+            # a cell cut in pieces has one loop per piece, one after the other
+            p = used[pos[c]]
+            key = (p.x, p.y)
+            self.cells[key].extend(sides[s:e])
+            self.verts[key].extend([sides[s][:2]] + ends[s:e])
+
+    def new_stats(self):
+        # seconds per method and counters, both since the last build
+        return {'time': {}, 'site_events': 0, 'circle_events': 0, 'circle_pushed': 0,
+                'circle_invalidated': 0, 'beach_max': 0, 'heap_max': 0,
+                'segments': 0, 'segments_dropped': 0, 'segments_split': 0}
+
+    @timed
     def process(self):
-        while len(self.points) != 0:
-            curr_event = heapq.heappop(self.points)
-            if isinstance(curr_event, Event):
-                if curr_event.valid:
-                    seg = ArcSegment(curr_event.p)
-                    self.lines.append(seg)
-
-                    a = curr_event.a
-                    if a.pprev is not None:
-                        a.pprev.pnext = a.pnext
-                        a.pprev.s1 = seg
-                    if a.pnext is not None:
-                        a.pnext.pprev = a.pprev
-                        a.pnext.s0 = seg
-
-                    if a.s0 is not None:
-                        a.s0.Finish(curr_event.p)
-                    if a.s1 is not None:
-                        a.s1.Finish(curr_event.p)
-
-                    if a.pprev is not None:
-                        self.check_circle_event(a.pprev, curr_event.x)
-                    if a.pnext is not None:
-                        self.check_circle_event(a.pnext, curr_event.x)
-            else:
-                self.arc_insert(curr_event)
+        step = self.step if self.stats is None and self.hook is None else self.traced_step
+        while len(self.events) != 0:
+            step()
         self.finish_edges()
 
+    def traced_step(self):
+        # step plus the counters and hook, kept apart so the plain sweep pays
+        # nothing for them
+        kind, payload = self.step()
+        if self.stats is not None:
+            st = self.stats
+            st['site_events' if kind == SITE else 'circle_events'] += 1
+            st['beach_max'] = max(st['beach_max'], self.arc_tree.size)
+            st['heap_max'] = max(st['heap_max'], len(self.events.heap))
+        if self.hook is not None:
+            self.hook('site' if kind == SITE else 'circle', self.sweep_x, payload.p.y if kind == CIRCLE else payload.y, payload)
+        return kind, payload
+
+    def step(self):
+        # handles the next event
+        x, y, seq, kind, curr_event = self.events.pop()
+        if kind == CIRCLE:
+            a = curr_event.a
+            seg = self.segment(curr_event.p, a.pprev.p, a.pnext.p)
+
+            self.arc_tree.remove(a)
+            if a.pprev is not None:
+                a.pprev.pnext = a.pnext
+                a.pprev.s1 = seg
+            if a.pnext is not None:
+                a.pnext.pprev = a.pprev
+                a.pnext.s0 = seg
+
+            self.finish(a.s0, curr_event.p)
+            self.finish(a.s1, curr_event.p)
+            if a.s0 is not None and a.s1 is not None and not self.stream:
+                # the three cells meeting at the new vertex
+                link(a.s0.h, a.s1.h.twin)
+                link(seg.h.twin, a.s0.h.twin)
+                link(a.s1.h, seg.h)
+            if not self.stream:
+                self.tri.extend((a.pprev.p.index, a.p.index, a.pnext.p.index))
+
+            if a.pprev is not None:
+                self.check_circle_event(a.pprev, curr_event.x)
+            if a.pnext is not None:
+                self.check_circle_event(a.pnext, curr_event.x)
+        else:
+            self.arc_insert(curr_event)
+        self.sweep_x = x
+        return kind, curr_event
+
+    def segment(self, point, p0, p1):
+        seg = ArcSegment(point, p0, p1, not self.stream)
+        self.segments += 1
+        if not self.stream:
+            self.lines.append(seg)
+        return seg
+
+    def finish(self, seg, point):
+        if seg is not None and not seg.done:
+            seg.Finish(point)
+            if self.stream:
+                self.finished.append(seg)
+
+    def edges(self, batch=1024):
+        # streaming mode: runs the sweep, yielding (x0, y0, x1, y1, i, j) for
+        # each edge as soon as it is finished, i and j the rows of the sites on
+        # either side. with clip the edges are cut to the bounding region batch
+        # at a time, yielding one tuple per piece inside it
+        step = self.step if self.stats is None and self.hook is None else self.traced_step
+        while True:
+            done = len(self.events) == 0
+            if done:
+                self.finish_edges()
+            else:
+                step()
+            if len(self.finished) >= (batch if self.clip else 1) or (done and self.finished):
+                segs = self.finished
+                self.finished = []
+                ends = np.array([(i.start.x, i.start.y, i.end.x, i.end.y) for i in segs], dtype=np.float64)
+                pairs = [(i.p0.index, i.p1.index) for i in segs]
+                if self.clip:
+                    pe, t0, t1 = clip_edges(ends, self.box_vert, self.region)[:3]
+                    for e, piece in zip(pe.tolist(), pieces(ends, pe, t0, t1).tolist()):
+                        yield tuple(piece) + pairs[e]
+                else:
+                    for e, p in zip(ends.tolist(), pairs):
+                        yield tuple(e) + p
+            if done:
+                return
+
     def arc_insert(self, point):
-        if self.arc_tree == None:
-            self.arc_tree = Arc(point)
+        if self.arc_tree.root is None:
+            self.arc_tree.insert_after(None, Arc(point))
         else:
-            i = self.arc_tree
-            while i is not None:
-                create, z = self.intersect(point,i)
-                if create:
-                    create, zz = self.intersect(point, i.pnext)
-                    if i.pnext is not None and not create:
-                        i.pnext.pprev = Arc(i.p, i, i.pnext)
-                        i.pnext = i.pnext.pprev
-                    else:
-                        i.pnext = Arc(i.p, i)
-                    i.pnext.s1 = i.s1
-
-                    i.pnext.pprev = Arc(point, i, i.pnext)
+            i = self.find_arc(point)
+            if i is not None:
+                create, z = self.intersect(point, i)
+            if i is None or not create:
+                # tree search is inconclusive for degenerate arcs, fall back to a scan
+                i = self.arc_tree.first()
+                while i is not None:
+                    create, z = self.intersect(point, i)
+                    if create:
+                        break
+                    i = i.pnext
+            if i is not None:
+                create, zz = self.intersect(point, i.pnext)
+                if i.pnext is not None and not create:
+                    i.pnext.pprev = Arc(i.p, i, i.pnext)
                     i.pnext = i.pnext.pprev
+                else:
+                    i.pnext = Arc(i.p, i)
+                self.arc_tree.insert_after(i, i.pnext)
+                i.pnext.s1 = i.s1
 
-                    i = i.pnext
+                i.pnext.pprev = Arc(point, i, i.pnext)
+                i.pnext = i.pnext.pprev
+                self.arc_tree.insert_after(i, i.pnext)
 
-                    segment = ArcSegment(z)
-                    self.lines.append(segment)
-                    i.pprev.s1 = i.s0 = segment
+                i = i.pnext
 
-                    segment = ArcSegment(z)
-                    self.lines.append(segment)
-                    i.pnext.s0 = i.s1 = segment
+                segment = self.segment(z, i.pprev.p, point)
+                i.pprev.s1 = i.s0 = segment
 
-                    self.check_circle_event(i, point.x)
-                    self.check_circle_event(i.pprev, point.x)
-                    self.check_circle_event(i.pnext, point.x)
+                segment = self.segment(z, point, i.pnext.p)
+                i.pnext.s0 = i.s1 = segment
 
-                    return
+                if not self.stream:
+                    # both halves of the new edge start at z
+                    link(i.s1.h.twin, i.s0.h)
+                    link(i.s0.h.twin, i.s1.h)
 
-                i = i.pnext
-            
-            i = self.arc_tree
-            while i.pnext is not None:
-                i = i.pnext
+                self.check_circle_event(i, point.x)
+                self.check_circle_event(i.pprev, point.x)
+                self.check_circle_event(i.pnext, point.x)
+
+                return
+
+            i = self.arc_tree.last()
             i.pnext = Arc(point, i)
+            self.arc_tree.insert_after(i, i.pnext)
 
-            x = self.x0
+            # sites sharing the first x are split by a line coming in from the
+            # far left, start it well outside the box like finish_edges does
+            x = self.x0 - (self.x1 - self.x0) - (self.y1 - self.y0)
             y = (i.pnext.p.y + i.p.y) / 2
             start = Point(x, y)
 
-            seg = ArcSegment(start)
+            seg = self.segment(start, i.p, point)
             i.s1 = i.pnext.s0 = seg
-            self.lines.append(seg)
+
+    def find_arc(self, point):
+        # descend the beach line tree comparing against the breakpoints at sweep x
+        i = self.arc_tree.root
+        while i is not None:
+            if i.p.x == point.x:
+                # arc is still a ray at its site's y
+                if point.y == i.p.y:
+                    return i
+                i = i.left if point.y < i.p.y else i.right
+            elif i.pprev is not None and point.y <= self.intersection(i.pprev.p, i.p, point.x).y:
+                i = i.left
+            elif i.pnext is not None and point.y > self.intersection(i.p, i.pnext.p, point.x).y:
+                i = i.right
+            else:
+                return i
+        return None
 
     def intersect(self, point, i):
         if i == None:
@@ -156,7 +401,7 @@ class Voronoi():
     def check_circle_event(self, i, x0):
         # look for a new circle event for arc i
         if (i.e is not None) and (i.e.x != self.x0):
-            i.e.valid = False
+            self.events.invalidate(i.e)
         i.e = None
 
         if (i.pprev is None) or (i.pnext is None): return
@@ -164,65 +409,49 @@ class Voronoi():
         flag, x, o = self.circle(i.pprev.p, i.p, i.pnext.p)
         if flag and (x > self.x0):
             i.e = Event(x, o, i)
-            heapq.heappush(self.points, i.e)
-            # self.event.push(i.e)
+            self.events.push_circle(i.e)
 
     def circle(self, a, b, c):
-        # check if bc is a "right turn" from ab
-        if ((b.x - a.x)*(c.y - a.y) - (c.x - a.x)*(b.y - a.y)) > 0: return False, None, None
-
-        A = b.x - a.x
-        B = b.y - a.y
-        C = c.x - a.x
-        D = c.y - a.y
-        E = A*(a.x + b.x) + B*(a.y + b.y)
-        F = C*(a.x + c.x) + D*(a.y + c.y)
-        G = 2*(A*(c.y - b.y) - B*(c.x - b.x))
-
-        if (G == 0): return False, None, None # Points are co-linear
+        # check if bc is a "right turn" from ab, collinear points have no
+        # circle. the sign is exact, see predicates.orient
+        if orient(a.x, a.y, b.x, b.y, c.x, c.y) >= 0: return False, None, None
 
         # point o is the center of the circle
-        ox = 1.0 * (D*E - B*F) / G
-        oy = 1.0 * (A*F - C*E) / G
+        ox, oy = circumcenter(a.x, a.y, b.x, b.y, c.x, c.y)
 
         # o.x plus radius equals max x coord
-        x = ox + math.sqrt((a.x-ox)**2 + (a.y-oy)**2)
+        x = circle_x(a.x, a.y, ox, oy)
         o = Point(ox, oy)
         
         return True, x, o
 
     def intersection(self, p0, p1, l):
-        # get the intersection of two parabolas
-        p = p0
-        if (p0.x == p1.x):
-            py = (p0.y + p1.y) / 2.0
-        elif (p1.x == l):
-            py = p1.y
-        elif (p0.x == l):
-            py = p0.y
-            p = p1
-        else:
-            # use quadratic formula
-            z0 = 2.0 * (p0.x - l)
-            z1 = 2.0 * (p1.x - l)
-
-            a = 1.0/z0 - 1.0/z1;
-            b = -2.0 * (p0.y/z0 - p1.y/z1)
-            c = 1.0 * (p0.y**2 + p0.x**2 - l**2) / z0 - 1.0 * (p1.y**2 + p1.x**2 - l**2) / z1
-
-            py = 1.0 * (-b-math.sqrt(b*b - 4*a*c)) / (2*a)
-            
+        # get the intersection of two parabolas, see predicates.breakpoint_y.
+        # x comes from the site farther from the sweep, which divides by the
+        # larger distance
+        py = breakpoint_y(p0.x, p0.y, p1.x, p1.y, l)
+        p = p0 if p0.x <= p1.x else p1
         px = 1.0 * (p.x**2 + (p.y-py)**2 - l**2) / (2*p.x-2*l)
         res = Point(px, py)
         return res
 
+    @timed
     def finish_edges(self):
+        if self.stats is not None:
+            self.stats['circle_pushed'] = self.events.circles
+            self.stats['circle_invalidated'] = self.events.invalidated
+            self.stats['segments'] = self.segments
         l = self.x1 + (self.x1 - self.x0) + (self.y1 - self.y0)
-        i = self.arc_tree
+        # breakpoints have to be evaluated past the last vertex or the
+        # remaining rays would be finished behind their start
+        l = max(l, self.sweep_x + (self.x1 - self.x0) + (self.y1 - self.y0))
+        i = self.arc_tree.first()
+        if i is None:
+            return
         while i.pnext is not None:
             if i.s1 is not None:
                 p = self.intersection(i.p, i.pnext.p, l*2)
-                i.s1.Finish(p)
+                self.finish(i.s1, p)
             i = i.pnext
     
     def print_lines(self):
@@ -234,6 +463,7 @@ class Voronoi():
             print(p0.x, p0.y, p1.x, p1.y)
     
     def output(self):
+        self.sync_lines()
         res = []
         for i in self.lines:
             p0 = i.start
@@ -241,6 +471,74 @@ class Voronoi():
             res.append((p0.x, p0.y, p1.x, p1.y))
         return res
 
+    def output_arrays(self):
+        # vertices float64 [V,2], edges int32 [E,2] indexing vertices and the
+        # two sites each edge separates as int32 [E,2] indexing self.sites.
+        # segments that meet at a vertex share its Point, so vertices are
+        # deduplicated by identity in order of first use
+        self.sync_lines()
+        ends = [p for seg in self.lines for p in (seg.start, seg.end)]
+        ids = np.fromiter(map(id, ends), dtype=np.uint64, count=len(ends))
+        ids, first, inv = np.unique(ids, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind='stable')
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order), dtype=np.int32)
+        first = first[order].tolist()
+        vertices = np.empty((len(first), 2), dtype=np.float64)
+        vertices[:, 0] = [ends[k].x for k in first]
+        vertices[:, 1] = [ends[k].y for k in first]
+        edges = rank[inv.reshape(-1)].reshape(-1, 2)
+        edge_sites = np.array([(seg.p0.index, seg.p1.index) for seg in self.lines], dtype=np.int32).reshape(-1, 2)
+        return vertices, edges, edge_sites
+
+    def to_diagram(self):
+        # the finished diagram as arrays with shared vertices, see diagram.py
+        return Diagram.from_voronoi(self)
+
+    def neighbor_arrays(self):
+        # the cell graph as CSR arrays over the rows of self.sites: the
+        # neighbours of row i are indices[indptr[i]:indptr[i+1]], ascending.
+        # edge numbers the edge each neighbour pair shares, the same from both
+        # sides. pairs [P,2] gives the (lower, higher) rows of each edge
+        # number, and seg_edge [E] the edge number of each segment in
+        # output_arrays(), so per-edge data can be gathered from the segments
+        # it is made of. cells are neighbours when segments in self.lines
+        # separate them, so after bind only edges left in the region count.
+        # a zero-length segment, where cocircular sites meet at a point, is
+        # no edge and its seg_edge is -1. int32
+        self.sync_lines()
+        n = len(self.sites)
+        segs = np.array([(seg.p0.index, seg.p1.index) for seg in self.lines], dtype=np.int64).reshape(-1, 2)
+        ends = np.array([(seg.start.x, seg.start.y, seg.end.x, seg.end.y) for seg in self.lines],
+                        dtype=np.float64).reshape(-1, 4)
+        real = np.any(ends[:, :2] != ends[:, 2:], axis=1)
+        # an edge is usually two segments, one traced each way from where it
+        # started, and clipping can cut it further
+        pairs, inv = np.unique(np.sort(segs[real], axis=1), axis=0, return_inverse=True)
+        seg_edge = np.full(len(segs), -1, dtype=np.int64)
+        seg_edge[real] = inv.reshape(-1)
+        e = np.arange(len(pairs))
+        rows = np.concatenate((pairs[:, 0], pairs[:, 1]))
+        cols = np.concatenate((pairs[:, 1], pairs[:, 0]))
+        e = np.concatenate((e, e))
+        o = np.lexsort((cols, rows))
+        indptr = np.zeros(n + 1, dtype=np.int32)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        return (indptr, cols[o].astype(np.int32), e[o].astype(np.int32), pairs.astype(np.int32),
+                seg_edge.astype(np.int32))
+
+    def delaunay_triangles(self):
+        # [T,3] int32 rows of self.sites, counter-clockwise, one per voronoi
+        # vertex the sweep found. raises ValueError when there are none to
+        # give, see no_topology
+        self.check_topology()
+        tri = np.array(self.tri, dtype=np.int32).reshape(-1, 3)
+        p = self.sites[tri]
+        cross = (p[:, 1, 0] - p[:, 0, 0]) * (p[:, 2, 1] - p[:, 0, 1]) - (p[:, 1, 1] - p[:, 0, 1]) * (p[:, 2, 0] - p[:, 0, 0])
+        cw = cross < 0
+        tri[cw, 1], tri[cw, 2] = tri[cw, 2], tri[cw, 1].copy()
+        return tri
+
     def display_output(self, draw, box=False):
         line = self.output()
         for i in line:
@@ -249,89 +547,79 @@ class Voronoi():
             for i in self.box_lines:
                 draw.line(i, (0,0,0))
 
-    def bind(self, draw):
-        out = self.output()
-        # print(self.box_lines)
-        for i in range(len(out))[::-1]:
-            # print(i)
-            if (self.isOutside(out[i][0], out[i][1]) and self.isOutside(out[i][2], out[i][3]) and 
-                self.lineOutside(out[i][0], out[i][1], out[i][2], out[i][3])):
-                # draw.line(out[i], (255,0,0))
-                self.lines.remove(self.lines[i])
-                # ind.append(i)
-            # elif (self.isOutside(out[i][0], out[i][1]) and self.isOutside(out[i][2], out[i][3]) and 
-            #     not self.lineOutside(out[i][0], out[i][1], out[i][2], out[i][3])):
-            #     print("test")
-            elif self.isOutside(out[i][0], out[i][1]) or self.isOutside(out[i][2], out[i][3]):
-                replace = []
-                new_lines = []
-                for j in self.box_lines:
-                    x1 = out[i][0]
-                    x2 = out[i][2]
-                    y1 = out[i][1]
-                    y2 = out[i][3]
-                    x3 = j[0]
-                    y3 = j[1]
-                    x4 = j[2]
-                    y4 = j[3]
-                    d = ((x1-x2)*(y3-y4))-((y1-y2)*(x3-x4))
-                    if d==0:
-                        t = -1
-                        u = -1
-                    else:
-                        t = (((x1-x3)*(y3-y4))-((y1-y3)*(x3-x4)))/(d)
-                        u = (((x2-x1)*(y1-y3))-((y2-y1)*(x1-x3)))/(d)
-                    if t <= 1 and t >= 0 and u <= 1 and u >= 0:
-                        px1 = x1+t*(x2-x1)
-                        py1 = y1+t*(y2-y1)
-                        replace.append((px1, py1))
-                        new_lines.append((x3, y3, px1, py1, x4, y4))
-
-                # print(replace)
-                if self.isOutside(self.lines[i].start.x, self.lines[i].start.y):
-                    x,y = max(replace, key=lambda x: math.sqrt((self.lines[i].end.x-x[0])**2+(self.lines[i].end.y-x[1])**2))
-                    self.lines[i].start = Point(x, y)
-                    for j in new_lines:
-                        ind = self.box_lines.index((j[0], j[1], j[4], j[5]))
-                        self.box_lines[ind:ind+1] = (j[0], j[1], j[2], j[3]), (j[2], j[3], j[4], j[5])
-                        # print(self.box_lines)
-                    
-                    
-                if self.isOutside(self.lines[i].end.x, self.lines[i].end.y):
-                    x,y = max(replace, key=lambda x: math.sqrt((self.lines[i].start.x-x[0])**2+(self.lines[i].start.y-x[1])**2))
-                    self.lines[i].end = Point(x, y)
-                    for j in new_lines:
-                        ind = self.box_lines.index((j[0], j[1], j[4], j[5]))
-                        self.box_lines[ind:ind+1] = (j[0], j[1], j[2], j[3]), (j[2], j[3], j[4], j[5])
-                        # print(self.box_lines)
-        # # removed = False
-        # for i in self.points_used[::-1]:
-        #     if self.isOutside(i.x, i.y):
-        #         self.points_used.remove(i)
-        #         removed = True
-        # if removed:
-        #     self.points = [x for x in self.points_used]
-        #     self.process()
+    def image(self, width, height, extent=None, palette=None, seed=None, edges=True):
+        # PIL image of the cells, coloured from palette (one row per site) or
+        # at random, with the segments drawn over them if edges. PIL is only
+        # imported here so the geometry never needs it
+        from PIL import Image, ImageDraw
+        if palette is None:
+            palette = np.random.default_rng(seed).integers(0, 256, (len(self.sites), 3))
+        im = Image.fromarray(colorize(self.label_image(width, height, extent), palette))
+        if edges:
+            if extent is not None:
+                x0, x1, y0, y1 = extent
+                sx = width / (x1 - x0)
+                sy = height / (y1 - y0)
+            draw = ImageDraw.Draw(im)
+            for i in self.output():
+                if extent is not None:
+                    i = ((i[0] - x0) * sx, (i[1] - y0) * sy, (i[2] - x0) * sx, (i[3] - y0) * sy)
+                draw.line(i, (0, 0, 0))
+        return im
+
+    def label_image(self, width, height, extent=None, out=None):
+        # int32 image of the site row owning each pixel, -1 outside the
+        # region. out can be a path to write a .npy memmap to, see raster
+        rows = np.array([p.index for p in self.points_used], dtype=np.int64)
+        return label_image(self.sites[rows], width, height, extent, self.region, out, rows)
+
+    @timed
+    def bind(self, draw=None):
+        # clips every segment to the box in one pass and splits the box lines
+        # wherever segments cross them, see clipping.py. each split box line
+        # goes to the site nearest its midpoint. draw is not used
+        ends = np.array(self.output(), dtype=np.float64).reshape(-1, 4)
+        pe, t0, t1, sides = clip_edges(ends, self.box_vert, self.region)
+        cut = pieces(ends, pe, t0, t1).tolist()
+        lines = []
+        seg = None
+        end = None
+        for e, a, b, c in zip(pe.tolist(), t0.tolist(), t1.tolist(), cut):
+            if seg is self.lines[e]:
+                # concave boxes can leave several pieces of one segment, the
+                # last one keeps the segment's original end
+                part = ArcSegment(Point(c[0], c[1]), seg.p0, seg.p1)
+                part.Finish(end if b == 1 else Point(c[2], c[3]))
+                if seg.parts is None:
+                    seg.parts = [seg]
+                seg.parts.append(part)
+                lines.append(part)
+                continue
+            # the first piece reuses the segment, untouched ends stay shared
+            seg = self.lines[e]
+            end = seg.end
+            if a != 0:
+                seg.start = Point(c[0], c[1])
+            if b != 1:
+                seg.end = Point(c[2], c[3])
+            lines.append(seg)
+        if self.stats is not None:
+            kept = len(np.unique(pe))
+            self.stats['segments_dropped'] += len(self.lines) - kept
+            self.stats['segments_split'] += len(lines) - kept
+        self.lines = lines
+
+        self.box_lines = [tuple(i) for i in sides.tolist()]
+        if len(self.points_used):
+            mid = (sides[:, :2] + sides[:, 2:]) / 2
+            self.box_owner = self.site_index().nearest(mid)
 
     def isOutside(self, x1, y1):
-        count = 0
-        y2 = y
-        x2 = max(self.box_vert, key=lambda x: x[0])[0]+100
-        for j in self.box_lines:
-            x3 = j[0]
-            y3 = j[1]
-            x4 = j[2]
-            y4 = j[3]
-            d = ((x1-x2)*(y3-y4))-((y1-y2)*(x3-x4))
-            if d == 0:
-                t = -1
-                u = -1
-            else:
-                t = (((x1-x3)*(y3-y4))-((y1-y3)*(x3-x4)))/(d)
-                u = (((x2-x1)*(y1-y3))-((y2-y1)*(x1-x3)))/(d)
-            if t <= 1 and t >= 0 and u <= 1 and u >= 0:
-                count+=1
-        return count%2==0
+        return not self.region.contains_point(x1, y1)
+
+    def insideMask(self, xy):
+        # bool mask of the rows of an [N,2] array that are inside the box
+        return self.region.contains(xy)
 
     def lineOutside(self, x1, y1, x2, y2):
         count = 0
@@ -351,175 +639,669 @@ class Voronoi():
                 count+=1
         return count==0
 
-    def assignLines(self):
+    def site_index(self):
+        # grid over points_used for nearest-site queries, built on first use
+        if self.index is None:
+            self.index = SiteIndex([(p.x, p.y) for p in self.points_used])
+            self.index_rows = np.array([p.index for p in self.points_used], dtype=np.int32)
+        return self.index
+
+    def locate(self, pts):
+        # int32 site row of the cell containing each row of an [M,2] array,
+        # -1 outside the region. a point's cell is its nearest site's, found
+        # through site_index and its cell table, built on the first call and
+        # kept until the sites change
+        pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+        out = np.full(len(pts), -1, dtype=np.int32)
+        if len(self.points_used) == 0:
+            return out
+        index = self.site_index()
+        index.cell_table()
+        inside = self.insideMask(pts)
+        out[inside] = self.index_rows[index.nearest(pts[inside])]
+        return out
+
+    def locate_point(self, x, y):
+        # locate for a single point
+        if len(self.points_used) == 0 or not self.region.contains_point(x, y):
+            return -1
+        return int(self.index_rows[self.site_index().nearest_point(x, y)])
+
+    @timed
+    def assignLines(self, tol=None):
         self.cells = {}
         self.verts = {}
         for i in self.points_used:
             self.cells[(i.x, i.y)] = set([])
             self.verts[(i.x, i.y)] = []
-        for i in self.output():
-            point = (i[0], i[1])
-            p2 = (i[2], i[3])
-            min_dist = min(self.points_used, key=lambda x: (x.x-point[0])**2+(x.y-point[1])**2)
-            min_dist = (min_dist.x-point[0])**2+(min_dist.y-point[1])**2
-            near = [x for x in self.points_used if round((x.x-point[0])**2+(x.y-point[1])**2) == round(min_dist)]
-            
-            min_dist = min(near, key=lambda x: (x.x-p2[0])**2+(x.y-p2[1])**2)
-            min_dist = (min_dist.x-p2[0])**2+(min_dist.y-p2[1])**2
-            near = [x for x in near if round((x.x-p2[0])**2+(x.y-p2[1])**2) == round(min_dist)]
-            for j in near:
-                self.cells[(j.x, j.y)].add(i)
-
-                
-        for i in self.box_lines:
-            point = (i[0], i[1])
-            p2 = (i[2], i[3])
-            min_dist = min(self.points_used, key=lambda x: (x.x-point[0])**2+(x.y-point[1])**2)
-            min_dist = (min_dist.x-point[0])**2+(min_dist.y-point[1])**2
-            near = [x for x in self.points_used if round((x.x-point[0])**2+(x.y-point[1])**2) == round(min_dist)]
-            
-            min_dist = min(near, key=lambda x: (x.x-p2[0])**2+(x.y-p2[1])**2)
-            min_dist = (min_dist.x-p2[0])**2+(min_dist.y-p2[1])**2
-            near = [x for x in near if round((x.x-p2[0])**2+(x.y-p2[1])**2) == round(min_dist)]
-            for j in near:
-                self.cells[(j.x, j.y)].add(i)
-
-
-        # print(self.cells)
+        if len(self.points_used) == 0:
+            return
+        if tol is None:
+            tol = 1e-6 * max(self.x1 - self.x0, self.y1 - self.y0, 1)
+
+        # every segment knows the two sites it separates from the sweep
+        for seg in self.lines:
+            line = (seg.start.x, seg.start.y, seg.end.x, seg.end.y)
+            self.cells[(seg.p0.x, seg.p0.y)].add(line)
+            self.cells[(seg.p1.x, seg.p1.y)].add(line)
+
+        # a box line belongs to the sites nearest its first end (within tol)
+        # that are also nearest its second end, unless bind already split the
+        # box at the cell borders and knows its owner
+        if self.box_owner is not None:
+            for i, j in zip(self.box_lines, self.box_owner.tolist()):
+                p = self.points_used[j]
+                self.cells[(p.x, p.y)].add(i)
+        elif len(self.box_lines):
+            ends = np.array(self.box_lines, dtype=np.float64).reshape(-1, 4)
+            index = self.site_index()
+            indptr, near = index.ties(ends[:, :2], tol)
+            rows = np.repeat(np.arange(len(ends)), np.diff(indptr))
+            d = np.hypot(index.sites[near, 0] - ends[rows, 2], index.sites[near, 1] - ends[rows, 3])
+            dmin = np.minimum.reduceat(d, indptr[:-1])
+            keep = d <= dmin[rows] + tol
+            for i, j in zip(rows[keep].tolist(), near[keep].tolist()):
+                p = self.points_used[j]
+                self.cells[(p.x, p.y)].add(self.box_lines[i])
+
         self.orderCells()
-        # print("\n\n")
-        # print(self.cells)
 
-        for i in self.cells:
-            # print(self.cells[i])
-            toAdd = (self.cells[i][0][0], self.cells[i][0][1])
-            self.verts[i].append(toAdd)
-            for j in self.cells[i]:
-                # self.verts[i].add((j[0], j[1]))
-                self.verts[i].append((j[2], j[3]))
+        # each loop of a cell starts with the first side's start and closes by
+        # coming back to it, see polygon_arrays
+        for i, sides in self.cells.items():
+            first = [(j[0], j[1]) for j in sides]
+            last = [(j[2], j[3]) for j in sides]
+            if first[1:] == last[:-1]:
+                self.verts[i] = first[:1] + last
+                continue
+            verts = self.verts[i]
+            for a, b in zip(first, last):
+                if len(verts) == 0 or verts[-1] != a:
+                    verts.append(a)
+                verts.append(b)
+
+    def polygon_arrays(self):
+        # the cells in verts as flat arrays: the site row of each polygon,
+        # offsets into the vertex list ([C+1]) and the vertices ([K,2]). a
+        # cell a concave box cuts into pieces gives one polygon per piece, so
+        # rows can repeat
+        polys = []
+        rows = []
+        for p in self.points_used:
+            for i in cell_pieces(self.verts[(p.x, p.y)]):
+                polys.append(i)
+                rows.append(p.index)
+        rows = np.array(rows, dtype=np.int64)
+        indptr = np.zeros(len(polys) + 1, dtype=np.int64)
+        np.cumsum([len(i) for i in polys], out=indptr[1:])
+        xy = np.array([v for i in polys for v in i], dtype=np.float64).reshape(-1, 2)
+        return rows, indptr, xy
+
+    def clip_masks(self, masks):
+        # the cells and segments inside each mask polygon, as a list of
+        # (rows, indptr, xy, edges, edge_sites), see masks.py. the diagram
+        # itself is left as it is
+        clipper = MaskClipper(self)
+        return [clipper.clip(m) for m in masks]
+
+    def relax(self, iterations=1, tolerance=0.0):
+        # lloyd relaxation: moves every site to the centroid of its cell and
+        # rebuilds, stopping once no site moves more than tolerance. the
+        # diagram is left bound and assigned. returns the time and largest
+        # move of each round
+        if self.verts is None:
+            self.bind()
+            self.assignLines()
+        stats = []
+        moved = np.empty_like(self.sites)
+        for it in range(iterations):
+            start = time.perf_counter()
+            rows, indptr, xy = self.polygon_arrays()
+            # the pieces of a cell cut by a concave box share one centroid
+            rows, group = np.unique(rows, return_inverse=True)
+            c = polygon_centroids(indptr, xy, group)
+            # empty cells, and centroids a concave box puts outside, stay put
+            ok = np.isfinite(c).all(1)
+            ok[ok] = self.insideMask(c[ok])
+            moved[:] = self.sites
+            moved[rows[ok]] = c[ok]
+            shift = np.sqrt(((moved[rows] - self.sites[rows]) ** 2).sum(1)).max() if len(rows) else 0.0
+            self.sites, moved = moved, self.sites
+            self.build()
+            self.bind()
+            self.assignLines()
+            stats.append({'iteration': it, 'time': time.perf_counter() - start, 'shift': float(shift)})
+            if shift <= tolerance:
+                break
+        return stats
+
+    def dynamic(self):
+        # sets up what add_site, remove_site and move_site need: the diagram
+        # bound and assigned, the sites next to each other across a clipped
+        # edge, the live sites by row and a bucket grid over them
+        if self.adjacency is not None:
+            return
+        if self.verts is None:
+            self.bind()
+            self.assignLines()
+        self.adjacency = {p.index: set() for p in self.points_used}
+        # the segments of each cell, edits replace a cell's segments here and
+        # sync_lines folds the changes into self.lines
+        self.site_lines = {p.index: set() for p in self.points_used}
+        self.added = []
+        self.dirty = False
+        for seg in self.lines:
+            self.adjacency[seg.p0.index].add(seg.p1.index)
+            self.adjacency[seg.p1.index].add(seg.p0.index)
+            self.site_lines[seg.p0.index].add(seg)
+            self.site_lines[seg.p1.index].add(seg)
+        self.site_at = {p.index: p for p in self.points_used}
+        self.slot = {p.index: k for k, p in enumerate(self.points_used)}
+        h = math.sqrt(max((self.x1 - self.x0) * (self.y1 - self.y0), 1e-300) / max(len(self.points_used), 1))
+        self.grid = SiteGrid(h)
+        for p in self.points_used:
+            self.grid.insert(p.index, p.x, p.y)
+
+    def add_site(self, x, y):
+        # adds a site as row len(self.sites) and returns the rows whose cells
+        # changed. only the cells around it are recomputed. self.cells,
+        # self.verts, points_used and self.lines are kept up to date. the
+        # half-edges and the delaunay triangles are not, neighbors() and
+        # delaunay_triangles() raise after an edit until the next build
+        self.dynamic()
+        self.check_free(x, y)
+        row = len(self.sites)
+        n = row + 1
+        if self.site_buf is None or len(self.site_buf) < n:
+            # room to grow, so adding sites one at a time stays cheap
+            self.site_buf = np.empty((max(2 * n, 16), 2), dtype=np.float64)
+            self.site_buf[:row] = self.sites
+        self.site_buf[row] = (x, y)
+        self.sites = self.site_buf[:n]
+        return self.insert_site(row)
+
+    def remove_site(self, row):
+        # removes the site at row from the diagram, its neighbours take over
+        # its cell. the row stays in self.sites. returns the changed rows
+        self.dynamic()
+        if row not in self.site_at:
+            raise ValueError("site %d is not in the diagram" % row)
+        p = self.site_at.pop(row)
+        self.grid.remove(row, p.x, p.y)
+        k = self.slot.pop(row)
+        last = self.points_used.pop()
+        if last is not p:
+            self.points_used[k] = last
+            self.slot[last.index] = k
+        del self.cells[(p.x, p.y)]
+        del self.verts[(p.x, p.y)]
+        core = self.adjacency.pop(row)
+        for i in core:
+            self.adjacency[i].discard(row)
+        self.drop_lines(row)
+        del self.site_lines[row]
+        self.index = None
+        self.box_owner = None
+        return self.recompute(core) | set([row])
+
+    def move_site(self, row, x, y):
+        # moves the site at row to (x, y), returns the changed rows
+        self.dynamic()
+        self.check_free(x, y, row)
+        changed = set()
+        if row in self.site_at:
+            changed = self.remove_site(row)
+        self.sites[row] = (x, y)
+        return changed | self.insert_site(row)
+
+    def check_free(self, x, y, row=None):
+        # the sweep needs distinct sites
+        i = self.grid.nearest(x, y)
+        if i is not None and i != row and self.site_at[i].x == x and self.site_at[i].y == y:
+            raise ValueError("there is already a site at (%r, %r)" % (x, y))
+
+    def insert_site(self, row):
+        x, y = self.sites[row].tolist()
+        if not self.region.contains_point(x, y):
+            # like the constructor, sites outside the region are left out
+            return set()
+        start = self.grid.nearest(x, y)
+        p = Point(x, y, row)
+        self.site_at[row] = p
+        self.slot[row] = len(self.points_used)
+        self.points_used.append(p)
+        self.grid.insert(row, x, y)
+        self.cells[(x, y)] = []
+        self.verts[(x, y)] = []
+        self.adjacency[row] = set()
+        self.site_lines[row] = set()
+        self.index = None
+        self.box_owner = None
+        # the cells the new site takes area from are connected, walk them out
+        # from the cell it lands in
+        core = set([row])
+        todo = [] if start is None else [start]
+        while todo:
+            i = todo.pop()
+            if i in core or not self.conflict(i, p):
+                continue
+            core.add(i)
+            todo.extend(self.adjacency[i])
+        return self.recompute(core, p)
+
+    def conflict(self, row, q):
+        # whether q is closer than row's site to any point of its cell
+        p = self.site_at[row]
+        for x, y in self.verts[(p.x, p.y)]:
+            if (x - q.x) ** 2 + (y - q.y) ** 2 < (x - p.x) ** 2 + (y - p.y) ** 2:
+                return True
+        return False
+
+    def recompute(self, core, q=None):
+        # replaces the cells of the core rows with those of a diagram of just
+        # the core and its neighbours. a cell is exact once no other site is
+        # closer to one of its vertices than its own, otherwise those sites
+        # (and any neighbour q conflicts with) join the core and it is redone
+        core = set(core)
+        while True:
+            near = set(core)
+            for i in core:
+                near |= self.adjacency[i]
+            rows = np.array(sorted(near), dtype=np.int64)
+            v = Voronoi(self.sites[rows], self.box_vert)
+            v.bind()
+            v.assignLines()
+            grow = set()
+            for i in core:
+                p = self.site_at[i]
+                for x, y in v.verts[(p.x, p.y)]:
+                    r = math.hypot(x - p.x, y - p.y) * (1 - 1e-9)
+                    grow.update(j for j in self.grid.within(x, y, r) if j not in near)
+            if q is not None:
+                grow.update(i for i in near - core if self.conflict(i, q))
+            if len(grow) == 0:
+                break
+            core |= grow
+
+        # v's vertices where the core meets the cells left around it come
+        # from another sweep and can be a rounding error off the old ones, so
+        # they are moved onto them and the seams stay shared
+        around = set()
+        for j in near - core:
+            p = self.site_at[j]
+            around.update(self.verts[(p.x, p.y)])
+        fresh = set()
+        for i in core:
+            p = self.site_at[i]
+            fresh.update(v.verts[(p.x, p.y)])
+        snap = snap_points(fresh - around, around, 1e-9 * max(self.x1 - self.x0, self.y1 - self.y0, 1))
+
+        # the core's segments are replaced with those of v, sharing the points
+        # of the segments left around them
+        for i in core:
+            self.drop_lines(i)
+        pts = {}
+        for j in near - core:
+            for seg in self.site_lines[j]:
+                pts[(seg.start.x, seg.start.y)] = seg.start
+                pts[(seg.end.x, seg.end.y)] = seg.end
+        for seg in v.lines:
+            for p in (seg.start, seg.end):
+                if (p.x, p.y) in snap:
+                    q = snap[(p.x, p.y)]
+                    pts.setdefault(q, Point(q[0], q[1]))
+                    pts.setdefault((p.x, p.y), pts[q])
+        local = {i: set() for i in core}
+        for seg in v.lines:
+            a = int(rows[seg.p0.index])
+            b = int(rows[seg.p1.index])
+            if a not in local and b not in local:
+                continue
+            if a in local:
+                local[a].add(b)
+            if b in local:
+                local[b].add(a)
+            new = ArcSegment(pts.setdefault((seg.start.x, seg.start.y), seg.start), self.site_at[a], self.site_at[b], False)
+            new.Finish(pts.setdefault((seg.end.x, seg.end.y), seg.end))
+            self.site_lines[a].add(new)
+            self.site_lines[b].add(new)
+            self.added.append(new)
+        self.no_topology = "add_site, remove_site and move_site don't update them, build() again"
+        for i in core:
+            p = self.site_at[i]
+            key = (p.x, p.y)
+            self.cells[key] = [snap.get(j[:2], j[:2]) + snap.get(j[2:], j[2:]) for j in v.cells[key]]
+            self.verts[key] = [snap.get(j, j) for j in v.verts[key]]
+            old = self.adjacency[i]
+            for j in old - local[i]:
+                self.adjacency[j].discard(i)
+            for j in local[i] - old:
+                self.adjacency[j].add(i)
+            self.adjacency[i] = local[i]
+        return core
+
+    def drop_lines(self, row):
+        # takes the segments of row's cell out of the diagram
+        for seg in self.site_lines[row]:
+            other = seg.p1.index if seg.p0.index == row else seg.p0.index
+            if other in self.site_lines:
+                self.site_lines[other].discard(seg)
+        self.site_lines[row] = set()
+        self.dirty = True
+
+    def sync_lines(self):
+        # self.lines after edits: the segments still in site_lines, in their
+        # old order, then the new ones
+        if self.adjacency is None or not self.dirty:
+            return
+        live = self.site_lines
+        self.lines = [seg for seg in self.lines + self.added if seg in live.get(seg.p0.index, ())]
+        self.added = []
+        self.dirty = False
+
+    def chain_heads(self):
+        # the half-edges with no prev, by site, from every segment the sweep
+        # made (bind can drop some from self.lines). built on first use
+        if self.heads is None:
+            self.heads = {}
+            for seg in self.swept:
+                if seg.h is not None:
+                    for h in (seg.h, seg.h.twin):
+                        if h.prev is None:
+                            self.heads.setdefault(h.site, []).append(h)
+        return self.heads
+
+    def check_topology(self):
+        if self.no_topology is not None:
+            raise ValueError("the half-edges and delaunay triangles are not available: " + self.no_topology)
+
+    def cell_half_edges(self, site):
+        # half-edges with site on their left, in counter-clockwise order. a
+        # closed cell is one cycle through site.edge. hull cells are open
+        # chains, and when every site is on one line a cell lies between two
+        # parallel edges with no vertex joining them, so every chain is
+        # walked from its first half-edge, one after the other
+        self.check_topology()
+        heads = self.chain_heads().get(site)
+        res = []
+        if heads is None:
+            h = first = site.edge
+            while h is not None:
+                res.append(h)
+                h = h.next
+                if h is first:
+                    break
+            return res
+        for h in heads:
+            while h is not None:
+                res.append(h)
+                h = h.next
+        return res
 
-    def orderCells(self):
-        for j in self.cells:
-            # temp = list(self.cells[j])
-            # check = len(temp)
-            # new_list = [temp[0]]
-            # temp = temp[1:]
-            # count = len(temp)
-            # while count != 0:
-            #     checkFound = False
-            #     for i in temp:
-            #         px = new_list[-1][2]
-            #         py = new_list[-1][3]
-            #         indRemove = -1
-            #         if px == i[0] and py == i[1]:
-            #             new_list.append(i)
-            #             indRemove = temp.index(i)
-            #             checkFound = True
-            #             break
-            #         elif px == i[2] and py == i[3]:
-            #             toAdd = (i[2], i[3], i[0], i[1])
-            #             new_list.append(toAdd)
-            #             indRemove = temp.index(i)
-            #             checkFound = True
-            #             break
-            #         temp.pop(indRemove)
-            #     print(checkFound)
-            #     count -=1
-            temp = list(self.cells[j])
-            # check = len(temp)
-            new_list = [temp[0]]
-            # temp = temp[1:]
-            count = len(temp)-1
-            while count != 0:
-                # checkFound = False
-                for i in temp:
-                    px = new_list[-1][2]
-                    py = new_list[-1][3]
-                    # print(px, py)
-                    # print(i)
-                    # print(px == i[0] and py == i[1], px == i[2] and py == i[3])
-                    # print('\n')
-                    if px == i[0] and py == i[1]:
-                        toAdd = (i[2], i[3], i[0], i[1])
-                        if toAdd not in new_list and i not in new_list:
-                            new_list.append(i)
-                        # checkFound = True
-                        # break
-                    elif px == i[2] and py == i[3]:
-                        toAdd = (i[2], i[3], i[0], i[1])
-                        if toAdd not in new_list and i not in new_list:
-                            new_list.append(toAdd)
-                        # checkFound = True
-                        # break
-                count -=1
-            # break
-            # print(new_list)
-            # print('\n\n\n')
-            self.cells[j] = new_list
+    def neighbors(self, site):
+        # sites across each edge of site's cell, in the same order as its
+        # edges, each once. a site event starts an edge as two half-edges
+        # that meet where it began, so a neighbour repeating the one before
+        # (or, around a closed cell, the first) is the same edge. zero-length
+        # edges, where cocircular sites meet at a point, don't count, as in
+        # neighbor_arrays
+        res = []
+        for h in self.cell_half_edges(site):
+            a = h.origin()
+            b = h.target()
+            if a is not None and b is not None and a.x == b.x and a.y == b.y:
+                continue
+            if len(res) == 0 or res[-1] is not h.twin.site:
+                res.append(h.twin.site)
+        if len(res) > 1 and res[0] is res[-1]:
+            res.pop()
+        return res
 
+    @timed
+    def orderCells(self):
+        # walks each cell's half-edges in order, keeping the segments that are
+        # still in self.lines, and bridges the gaps clipping left with the box
+        # lines assigned to the cell, see cell_loops
+        live = set(map(id, self.lines))
+        box_lines = set(self.box_lines)
+        for site in self.points_used:
+            key = (site.x, site.y)
+            edges = []
+            for h in self.cell_half_edges(site):
+                parts = h.seg.parts if h.seg.parts is not None else [h.seg]
+                if not h.forward:
+                    parts = parts[::-1]
+                for i in parts:
+                    if id(i) in live:
+                        a, b = (i.start, i.end) if h.forward else (i.end, i.start)
+                        edges.append((a.x, a.y, b.x, b.y))
+
+            box = [i for i in self.cells[key] if i in box_lines]
+            ends = {}
+            for k, i in enumerate(box):
+                ends.setdefault(i[:2], []).append(k)
+                ends.setdefault(i[2:], []).append(k)
+            used = set()
+            if len(edges) == 0 and len(box) != 0:
+                used.add(0)
+                edges.append(box[0])
+
+            self.cells[key] = self.cell_loops(edges, box, ends, used)
+
+    def cell_loops(self, edges, box, ends, used):
+        # joins the cell's edges into loops. an edge goes on to the next one
+        # if that starts where it ends, else along the cell's box lines to
+        # the first edge start they reach. a concave box can cut a cell into
+        # pieces, and the edges of one piece need not follow each other in
+        # the walk, so every piece comes out as its own loop, the loops one
+        # after the other
+        n = len(edges)
+        first = [i[:2] for i in edges]
+        if first[1:] + first[:1] == [i[2:] for i in edges]:
+            # a cell clipping left alone
+            return edges
+        starts = {}
+        for k, i in enumerate(edges):
+            starts.setdefault(i[:2], []).append(k)
+        succ = [-1] * n
+        bridge = [()] * n
+        entered = [False] * n
+        for k, i in enumerate(edges):
+            p = i[2:]
+            nxt = (k + 1) % n
+            if edges[nxt][:2] != p or entered[nxt]:
+                nxt = next((j for j in starts.get(p, ()) if not entered[j]), -1)
+            if nxt < 0:
+                bridge[k], nxt = self.box_path(box, ends, used, p, starts, entered)
+            if nxt >= 0:
+                succ[k] = nxt
+                entered[nxt] = True
+        # open chains (no box lines to close them, before bind) from their
+        # first edge, then the loops
+        res = []
+        seen = [False] * n
+        for k in sorted(range(n), key=lambda k: entered[k]):
+            while k >= 0 and not seen[k]:
+                seen[k] = True
+                res.append(edges[k])
+                res.extend(bridge[k])
+                k = succ[k]
+        return res
 
+    def box_path(self, box, ends, used, p, starts, entered):
+        # box lines leading from p to the start of an edge no other edge leads
+        # to yet, as (lines, edge), or ((), -1) if they don't get there
+        path = []
+        taken = []
+        while True:
+            nxt = [k for k in ends.get(p, ()) if k not in used]
+            if len(nxt) == 0:
+                used.difference_update(taken)
+                return (), -1
+            k = nxt[0]
+            used.add(k)
+            taken.append(k)
+            i = box[k]
+            if i[:2] == p:
+                path.append(i)
+                p = i[2:]
+            else:
+                path.append((i[2], i[3], i[0], i[1]))
+                p = i[:2]
+            for j in starts.get(p, ()):
+                if not entered[j]:
+                    return path, j
+
+def snap_points(new, old, tol):
+    # maps each point of new within tol of a point of old (both sets of
+    # (x, y)) to the nearest such point
+    if len(new) == 0 or len(old) == 0:
+        return {}
+    new = list(new)
+    old = list(old)
+    a = np.array(new, dtype=np.float64)
+    b = np.array(old, dtype=np.float64)
+    d = np.abs(a[:, None] - b[None]).max(2)
+    k = d.argmin(1)
+    hit = np.flatnonzero(d[np.arange(len(new)), k] <= tol)
+    return {new[i]: old[j] for i, j in zip(hit.tolist(), k[hit].tolist())}
+
+def cell_pieces(verts):
+    # splits a cell's vertex list into its loops, each ending with a repeat
+    # of its first vertex. an open chain (before bind) is one piece.
+    # zero-length sides, where cocircular sites meet, repeat a vertex in
+    # place and don't end a loop. those sites can also leave two vertices a
+    # rounding error apart joined through a third, so a loop passes its
+    # first vertex again; the sliver that splits off encloses nothing and
+    # goes back into the loop it came from
+    n = len(verts)
+    if n == 0:
+        return [verts]
+    res = []
+    k = 0
+    while k < n:
+        j = k + 1
+        while j < n and verts[j] == verts[k]:
+            j += 1
+        try:
+            j = verts.index(verts[k], j)
+        except ValueError:
+            j = n - 1
+        while j + 1 < n and verts[j + 1] == verts[k]:
+            j += 1
+        res.append(verts[k:j + 1])
+        k = j + 1
+    k = 0
+    while len(res) > 1 and k < len(res):
+        if len(set(res[k])) < 3:
+            if k + 1 < len(res):
+                res[k + 1] = res[k] + res[k + 1]
+            else:
+                res[k - 1] = res[k - 1] + res[k]
+            del res[k]
+        else:
+            k += 1
+    return res
+
+def polygon_centroids(indptr, xy, group=None):
+    # area centroids of the polygons xy[indptr[i]:indptr[i+1]], [C,2]. the
+    # shoelace terms run over every vertex and its successor, wrapping at the
+    # end of each polygon. with group (one label 0..G-1 per polygon) the
+    # polygons of a label make one shape and the result is [G,2]. degenerate
+    # polygons give nan
+    counts = np.diff(indptr)
+    poly = np.repeat(np.arange(len(counts)), counts)
+    nxt = np.arange(1, len(xy) + 1)
+    last = indptr[1:][counts > 0] - 1
+    nxt[last] = indptr[:-1][counts > 0]
+    x = xy[:, 0]
+    y = xy[:, 1]
+    cross = x * y[nxt] - x[nxt] * y
+    n = len(counts)
+    if group is not None:
+        poly = np.asarray(group)[poly]
+        n = int(np.max(group)) + 1 if len(group) else 0
+    area = np.bincount(poly, cross, n) * 3
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cx = np.bincount(poly, (x + x[nxt]) * cross, n) / area
+        cy = np.bincount(poly, (y + y[nxt]) * cross, n) / area
+    return np.column_stack((cx, cy))
 
 class Point():
-    def __init__(self, x, y):
+    __slots__ = ('x', 'y', 'index', 'edge')
+
+    def __init__(self, x, y, index=None):
         self.x = x
         self.y = y
-
-    def __lt__(self, obj):
-        # self < obj
-        return self.x < obj.x
-
-    def __le__(self, obj):
-        # self <= obj
-        return self.x <= obj.x
-
-    def __eq__(self, obj):
-        # self == obj.
-        return self.x == obj.x
-
-    def __ne__(self, obj):
-        # self != obj.
-        return self.x != obj.x
-
-    def __gt__(self, obj):
-        # self > obj.
-        return self.x > obj.x
-
-    def __ge__(self, obj):
-        # self >= obj.
-        return self.x >= obj.x
+        self.index = index
+        # for sites, one of the half-edges around its cell
+        self.edge = None
 
 class Event():
+    __slots__ = ('x', 'p', 'a', 'valid')
+
     def __init__(self, x, point, a):
         self.x = x
         self.p = point
         self.a = a
         self.valid = True
 
-    def __lt__(self, obj):
-        # self < obj.
-        return self.x < obj.x
-
-    def __le__(self, obj):
-        # self <= obj.
-        return self.x <= obj.x
-
-    def __eq__(self, obj):
-        # self == obj.
-        return self.x == obj.x
-
-    def __ne__(self, obj):
-        # self != obj.
-        return self.x != obj.x
-
-    def __gt__(self, obj):
-        # self > obj.
-        return self.x > obj.x
-
-    def __ge__(self, obj):
-        # self >= obj.
-        return self.x >= obj.x
+SITE = 0
+CIRCLE = 1
+
+class EventQueue():
+    # binary heap of (x, y, seq, kind, payload) tuples so the ordering is done
+    # by tuple comparison in C, seq keeps ties stable and payloads uncompared.
+    # circle events are invalidated lazily and the heap is rebuilt once the
+    # dead ones make up more than compact_ratio of it
+    compact_ratio = 0.5
+    compact_min = 1024
+
+    def __init__(self, points=()):
+        self.heap = [(p.x, p.y, seq, SITE, p) for seq, p in enumerate(points)]
+        heapq.heapify(self.heap)
+        self.seq = len(self.heap)
+        self.invalid = 0
+        # totals for Voronoi.stats
+        self.circles = 0
+        self.invalidated = 0
+
+    def __len__(self):
+        return len(self.heap) - self.invalid
+
+    def push_site(self, point):
+        heapq.heappush(self.heap, (point.x, point.y, self.seq, SITE, point))
+        self.seq += 1
+
+    def push_circle(self, event):
+        heapq.heappush(self.heap, (event.x, event.p.y, self.seq, CIRCLE, event))
+        self.seq += 1
+        self.circles += 1
+
+    def pop(self):
+        # returns the next live event, dropping dead circle events on the way
+        while True:
+            item = heapq.heappop(self.heap)
+            if item[3] == SITE or item[4].valid:
+                return item
+            self.invalid -= 1
+
+    def invalidate(self, event):
+        if event.valid:
+            event.valid = False
+            self.invalid += 1
+            self.invalidated += 1
+            if self.invalid > self.compact_min and self.invalid > self.compact_ratio * len(self.heap):
+                self.compact()
+
+    def compact(self):
+        self.heap = [i for i in self.heap if i[3] == SITE or i[4].valid]
+        heapq.heapify(self.heap)
+        self.invalid = 0
 
 class Arc():
+    __slots__ = ('p', 'pprev', 'pnext', 'e', 's0', 's1', 'left', 'right', 'parent', 'prio')
+
     def __init__(self, point, prev=None, nex=None):
         self.p = point
         self.pprev = prev
@@ -527,12 +1309,135 @@ class Arc():
         self.e = None
         self.s0 = None
         self.s1 = None
+        # beach line tree links
+        self.left = None
+        self.right = None
+        self.parent = None
+        self.prio = 0
+
+class BeachLine():
+    # treap over the arcs, in the same order as the pprev/pnext list, so the
+    # arc above a new site can be found in O(log n) instead of walking the list
+    def __init__(self):
+        self.root = None
+        self.rand = random.Random(0)
+        self.size = 0
+
+    def first(self):
+        i = self.root
+        if i is not None:
+            while i.left is not None:
+                i = i.left
+        return i
+
+    def last(self):
+        i = self.root
+        if i is not None:
+            while i.right is not None:
+                i = i.right
+        return i
+
+    def insert_after(self, a, arc):
+        # places arc directly after a in order (a is None only for an empty tree)
+        arc.prio = self.rand.random()
+        self.size += 1
+        if a is None:
+            self.root = arc
+            return
+        if a.right is None:
+            a.right = arc
+        else:
+            a = a.right
+            while a.left is not None:
+                a = a.left
+            a.left = arc
+        arc.parent = a
+        while arc.parent is not None and arc.parent.prio < arc.prio:
+            self.rotate_up(arc)
+
+    def remove(self, arc):
+        # rotate arc down to a leaf, then cut it off
+        self.size -= 1
+        while arc.left is not None or arc.right is not None:
+            if arc.right is None or (arc.left is not None and arc.left.prio > arc.right.prio):
+                self.rotate_up(arc.left)
+            else:
+                self.rotate_up(arc.right)
+        p = arc.parent
+        if p is None:
+            self.root = None
+        elif p.left is arc:
+            p.left = None
+        else:
+            p.right = None
+        arc.parent = None
+
+    def rotate_up(self, x):
+        p = x.parent
+        g = p.parent
+        if p.left is x:
+            p.left = x.right
+            if x.right is not None:
+                x.right.parent = p
+            x.right = p
+        else:
+            p.right = x.left
+            if x.left is not None:
+                x.left.parent = p
+            x.left = p
+        p.parent = x
+        x.parent = g
+        if g is None:
+            self.root = x
+        elif g.left is p:
+            g.left = x
+        else:
+            g.right = x
+
+class HalfEdge():
+    # one side of an ArcSegment, with site on its left. the forward half runs
+    # from seg.start to seg.end, its twin the other way. next/prev link the
+    # half-edges around site's cell counter-clockwise
+    __slots__ = ('site', 'seg', 'forward', 'twin', 'next', 'prev')
+
+    def __init__(self, site, seg, forward):
+        self.site = site
+        self.seg = seg
+        self.forward = forward
+        self.twin = None
+        self.next = None
+        self.prev = None
+        if site.edge is None:
+            site.edge = self
+
+    def origin(self):
+        return self.seg.start if self.forward else self.seg.end
+
+    def target(self):
+        return self.seg.end if self.forward else self.seg.start
+
+def link(a, b):
+    a.next = b
+    b.prev = a
 
 class ArcSegment():
-    def __init__(self, point):
+    __slots__ = ('start', 'end', 'done', 'p0', 'p1', 'h', 'parts')
+
+    def __init__(self, point, p0, p1, topology=True):
         self.start = point
         self.end = None
         self.done = False
+        # pieces in start to end order once clipping splits the segment
+        self.parts = None
+        # sites on either side, p0 below p1 on the beach line. the breakpoint
+        # tracing the segment always has the upper site on its left
+        self.p0 = p0
+        self.p1 = p1
+        self.h = None
+        if topology:
+            self.h = HalfEdge(p1, self, True)
+            self.h.twin = HalfEdge(p0, self, False)
+            self.h.twin.twin = self.h
 
     def Finish(self, point):
         if not self.done:
@@ -540,19 +1445,14 @@ class ArcSegment():
             self.done = True
 
 if __name__ == "__main__":
+    from PIL import Image, ImageDraw
+    from sampling import uniform
     # points = generatePoints(50, 100, 'uniform')
     # points = [(100,100), (200,200), (200,100), (100,200)]
     # points = [(100,100), (200,200), (220,100)]
     maxX = 1500
     maxY = 900
-    points = []
-    for i in range(50):
-        x = random.randint(0,maxX)
-        y = random.randint(0,maxY)
-        while((x,y) in points):
-            x = random.randint(0,maxX)
-            y = random.randint(0,maxY)
-        points.append((x,y))
+    points = uniform(50, [(0, 0), (0, maxY), (maxX, maxY), (maxX, 0)], integer=True)
     bound = (0,maxX,0,maxY)
     bound = (150,maxX-150,150,maxY-150)
     box_vert = [(150, 150), (150, maxY-150), (300, maxY-500) ,(maxX-100, maxY-150), (maxX-100, 200), (maxX-200, 300)]
@@ -560,7 +1460,10 @@ if __name__ == "__main__":
     # bound = [box_vert[i]+box_vert[i+1] if i < len(box_vert)-1 else box_vert[i]+box_vert[0] for i in range(len(box_vert))]
     test = Voronoi(points, bounding_box=box_vert)
 
-    landscape = Image.new("RGB", (maxX,maxY), (255, 255, 255))
+    # cells are filled from the label image, one palette lookup per pixel
+    labels = test.label_image(maxX, maxY)
+    palette = np.random.randint(0, 256, (len(test.sites), 3))
+    landscape = Image.fromarray(colorize(labels, palette))
     draw = ImageDraw.Draw(landscape)
     
     
@@ -571,10 +1474,7 @@ if __name__ == "__main__":
     
     
     for i in test.verts:
-        color = (random.randint(0,255),random.randint(0,255),random.randint(0,255))
-
-        draw.polygon(list(test.verts[i]), fill=color)
         draw.rectangle([i[0]-3, i[1]-3, i[0]+3, i[1]+3], (0,0,0))
         
     landscape.show()
-    # test.print_lines()
\ No newline at end of file
+    # test.print_lines()
@@ -0,0 +1,109 @@
+import numpy as np
+from clipping import clip_edges, pieces
+from region import Region
+from spatial import SiteIndex, SegmentIndex
+
+
+# clipping of one finished diagram against many mask polygons, without
+# touching the diagram. the segments, the side of each segment every site is
+# on, a grid over the segments and the nearest-site index are set up once;
+# each mask then only clips the segments near it and walks the cells it cuts
+# out, so the work per mask follows the size of its output. masks should lie
+# where the diagram has segments: anywhere for a diagram that was not bound,
+# inside the bounding region for one that was
+
+
+class MaskClipper():
+    def __init__(self, v):
+        ends = np.array(v.output(), dtype=np.float64).reshape(-1, 4)
+        pairs = np.array([(seg.p0.index, seg.p1.index) for seg in v.lines], dtype=np.int64).reshape(-1, 2)
+        # orient the sites of every segment as (left, right) of start -> end,
+        # so a cell lies to the left of its own segments
+        p = v.sites[pairs[:, 0]]
+        cross = (ends[:, 2] - ends[:, 0]) * (p[:, 1] - ends[:, 1]) - (ends[:, 3] - ends[:, 1]) * (p[:, 0] - ends[:, 0])
+        keep = cross != 0
+        self.edges = ends[keep]
+        self.edge_sites = np.where((cross[keep] > 0)[:, None], pairs[keep], pairs[keep, ::-1])
+        self.rows = np.array([i.index for i in v.points_used], dtype=np.int64)
+        self.index = SiteIndex(v.sites[self.rows])
+        lo = np.array([v.x0, v.y0], dtype=np.float64)
+        hi = np.array([v.x1, v.y1], dtype=np.float64)
+        if len(self.rows):
+            lo = np.minimum(lo, self.index.sites.min(0))
+            hi = np.maximum(hi, self.index.sites.max(0))
+        self.grid = SegmentIndex(self.edges, lo, hi)
+
+    def clip(self, poly):
+        # the diagram inside poly as (rows, indptr, xy, edges, edge_sites):
+        # the cells as in polygon_arrays, counter-clockwise and one polygon
+        # per piece, so a concave mask can give a site several; and the
+        # clipped segments [P,4] with the site rows either side [P,2]
+        poly = np.asarray(poly, dtype=np.float64).reshape(-1, 2)
+        if len(self.rows) == 0:
+            # no sites, no cells to cut out
+            return (np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64), np.zeros((0, 2)),
+                    np.zeros((0, 4)), np.zeros((0, 2), dtype=np.int32))
+        lo = poly.min(0)
+        hi = poly.max(0)
+        near = self.grid.query(lo[0], hi[0], lo[1], hi[1])
+        pe, t0, t1, sides = clip_edges(self.edges[near], poly, Region(poly))
+        cut = pieces(self.edges[near], pe, t0, t1)
+        cut_sites = self.edge_sites[near[pe]]
+        # mask sides run with the mask inside on their left, each belongs to
+        # the site nearest its midpoint
+        if signed_area(poly) < 0:
+            sides = sides[:, [2, 3, 0, 1]]
+        owner = self.rows[self.index.nearest((sides[:, :2] + sides[:, 2:]) / 2)]
+        # every cell boundary as directed segments, the cell on their left
+        seg = np.vstack((cut, cut[:, [2, 3, 0, 1]], sides))
+        cell = np.concatenate((cut_sites[:, 0], cut_sites[:, 1], owner))
+        rows, indptr, xy = loops(cell, seg)
+        return rows, indptr, xy, cut, cut_sites.astype(np.int32)
+
+
+def loops(cell, seg):
+    # chains directed segments into closed polygons, one per loop, sorted by
+    # cell. a segment continues with the segment of the same cell starting
+    # where it ends; shared ends are exactly equal, see clipping.at
+    n = len(seg)
+    c = np.concatenate((cell, cell))
+    x = np.concatenate((seg[:, 0], seg[:, 2]))
+    y = np.concatenate((seg[:, 1], seg[:, 3]))
+    o = np.lexsort((y, x, c))
+    new = np.ones(2 * n, dtype=bool)
+    new[1:] = (c[o][1:] != c[o][:-1]) | (x[o][1:] != x[o][:-1]) | (y[o][1:] != y[o][:-1])
+    inv = np.empty(2 * n, dtype=np.int64)
+    inv[o] = np.cumsum(new) - 1
+    by_start = np.full(2 * n, -1, dtype=np.int64)
+    by_start[inv[:n]] = np.arange(n)
+    succ = by_start[inv[n:]].tolist()
+    # loops are walked in order of their lowest segment, cells stay grouped
+    # after a stable sort
+    seen = [False] * n
+    order = []
+    lengths = []
+    first = []
+    for k in range(n):
+        if seen[k]:
+            continue
+        m = len(order)
+        while k >= 0 and not seen[k]:
+            seen[k] = True
+            order.append(k)
+            k = succ[k]
+        lengths.append(len(order) - m)
+        first.append(order[m])
+    lengths = np.array(lengths, dtype=np.int64)
+    rows = cell[np.array(first, dtype=np.int64)] if first else np.zeros(0, dtype=np.int64)
+    o = np.argsort(rows, kind='stable')
+    starts = np.cumsum(lengths) - lengths
+    sel = np.repeat(starts[o], lengths[o]) + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths[o]) - lengths[o], lengths[o])
+    order = np.array(order, dtype=np.int64)[sel]
+    indptr = np.zeros(len(o) + 1, dtype=np.int64)
+    np.cumsum(lengths[o], out=indptr[1:])
+    return rows[o], indptr, seg[order, :2].reshape(-1, 2)
+
+
+def signed_area(poly):
+    q = np.roll(poly, -1, axis=0)
+    return (poly[:, 0] * q[:, 1] - q[:, 0] * poly[:, 1]).sum() / 2
@@ -0,0 +1,101 @@
+import math
+from fractions import Fraction
+
+
+# geometric predicates for the sweep. each one takes the float answer when an
+# error bound shows its sign can be trusted and only falls back to exact
+# rational arithmetic when it can't, so ordinary input stays on the fast path
+# and degenerate input (grids, integer sites, cocircular sites) still gets the
+# right answer
+
+EPS = 2.0 ** -53
+# Shewchuk's bound on the error of the float orientation determinant,
+# relative to the sum of the magnitudes of its two products
+ORIENT_BOUND = (3.0 + 16.0 * EPS) * EPS
+CENTER_MARGIN = 2.0 ** 30
+
+
+def orient(ax, ay, bx, by, cx, cy):
+    # sign of the turn a -> b -> c: 1 counter-clockwise, -1 clockwise, 0 when
+    # the points are collinear
+    left = (bx - ax) * (cy - ay)
+    right = (cx - ax) * (by - ay)
+    det = left - right
+    bound = ORIENT_BOUND * (abs(left) + abs(right))
+    if det > bound:
+        return 1
+    if det < -bound:
+        return -1
+    # repeated coordinates make both products exactly zero, the usual
+    # degenerate case needs no fractions
+    if (bx == ax or cy == ay) and (cx == ax or by == ay):
+        return 0
+    return orient_exact(ax, ay, bx, by, cx, cy)
+
+
+def orient_exact(ax, ay, bx, by, cx, cy):
+    # floats convert to fractions exactly, so this is the true sign
+    ax, ay, bx, by, cx, cy = map(Fraction, (ax, ay, bx, by, cx, cy))
+    det = (bx - ax) * (cy - ay) - (cx - ax) * (by - ay)
+    return (det > 0) - (det < 0)
+
+
+def circumcenter(ax, ay, bx, by, cx, cy):
+    # centre of the circle through a, b and c, which must not be collinear.
+    # the float centre's relative error grows as the determinant nears its
+    # error bound, so unless it is well clear of it (CENTER_MARGIN times) the
+    # centre is worked out exactly and rounded once
+    A = bx - ax
+    B = by - ay
+    C = cx - ax
+    D = cy - ay
+    left = A * D
+    right = C * B
+    if abs(left - right) > CENTER_MARGIN * ORIENT_BOUND * (abs(left) + abs(right)):
+        G = 2 * (left - right)
+        b2 = A * A + B * B
+        c2 = C * C + D * D
+        return ax + (D * b2 - B * c2) / G, ay + (A * c2 - C * b2) / G
+    ax, ay, bx, by, cx, cy = map(Fraction, (ax, ay, bx, by, cx, cy))
+    A = bx - ax
+    B = by - ay
+    C = cx - ax
+    D = cy - ay
+    G = 2 * (A * D - C * B)
+    b2 = A * A + B * B
+    c2 = C * C + D * D
+    return float(ax + (D * b2 - B * c2) / G), float(ay + (A * c2 - C * b2) / G)
+
+
+def circle_x(ax, ay, ox, oy):
+    # rightmost x of the circle about o through a. for a centre far to the
+    # left of a, ox + r cancels away every digit, so the distance past a is
+    # taken as dy^2 / (r + dx) instead
+    dx = ax - ox
+    dy = ay - oy
+    r = math.sqrt(dx * dx + dy * dy)
+    if dx > 0:
+        return ax + dy * dy / (r + dx)
+    return ox + r
+
+
+def breakpoint_y(p0x, p0y, p1x, p1y, l):
+    # y of the breakpoint between the arcs of p0 (below) and p1 (above) with
+    # the sweep at x = l. with d0, d1 the sites' signed distances to the sweep
+    # the quadratic's discriminant factors as d0*d1*|p1 - p0|^2, which can't
+    # be negative since both sites are behind the sweep; it is clamped at
+    # zero for a sweep rounded a hair behind a site. the root is taken in the
+    # form that avoids cancellation
+    if p0x == p1x:
+        return (p0y + p1y) / 2.0
+    d0 = p0x - l
+    d1 = p1x - l
+    a = p1x - p0x
+    dy = p1y - p0y
+    dd = d0 * d1
+    s = math.sqrt(dd * (a * a + dy * dy)) if dd > 0 else 0.0
+    b = d0 * dy
+    if b < 0:
+        c = -d0 * (dy * dy + d1 * a)
+        return p0y + c / (s - b)
+    return p0y - (b + s) / a
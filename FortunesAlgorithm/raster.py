@@ -0,0 +1,61 @@
+import numpy as np
+from region import Region
+from spatial import SiteIndex
+
+
+# cell id rasters. every pixel gets the index of the site nearest its centre,
+# which is the cell it lies in, or -1 outside the region. the image is worked
+# through in bands of rows so only the band's coordinates are ever in memory,
+# and it can be written straight into a memory mapped .npy file
+
+
+def label_image(sites, width, height, extent=None, region=None, out=None, ids=None, rows=256):
+    # [height, width] int32 labels indexing sites, or ids[site] if given.
+    # extent is (x0, x1, y0, y1), the area the image covers, by default one
+    # unit per pixel from the origin. region is a Region or polygon. out is an
+    # array to fill or a path for a new .npy memmap
+    sites = np.asarray(sites, dtype=np.float64).reshape(-1, 2)
+    if extent is None:
+        extent = (0, width, 0, height)
+    x0, x1, y0, y1 = extent
+    if region is not None and not isinstance(region, Region):
+        region = Region(region)
+    if out is None:
+        out = np.empty((height, width), dtype=np.int32)
+    elif isinstance(out, str):
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=np.int32, shape=(height, width))
+
+    if len(sites) == 0:
+        # no cells, every pixel is outside them
+        out[:] = -1
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+    index = SiteIndex(sites)
+    xs = x0 + (np.arange(width) + 0.5) * (x1 - x0) / width
+    for r in range(0, height, rows):
+        ys = y0 + (np.arange(r, min(r + rows, height)) + 0.5) * (y1 - y0) / height
+        pts = np.column_stack((np.tile(xs, len(ys)), np.repeat(ys, width)))
+        lab = np.full(len(pts), -1, dtype=np.int32)
+        # only pixels inside the region are looked up
+        inside = slice(None) if region is None else region.contains(pts)
+        near = index.nearest(pts[inside])
+        if ids is not None:
+            near = np.where(near < 0, -1, ids[near])
+        lab[inside] = near
+        out[r:r + len(ys)] = lab.reshape(len(ys), width)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def colorize(labels, palette, background=(255, 255, 255), out=None, rows=1024):
+    # [H, W, 3] uint8 image from a label image, one palette row per site and
+    # background where the label is -1
+    pal = np.vstack((np.asarray(palette, dtype=np.uint8).reshape(-1, 3), np.asarray(background, dtype=np.uint8)))
+    if out is None:
+        out = np.empty(labels.shape + (3,), dtype=np.uint8)
+    for r in range(0, len(labels), rows):
+        # -1 picks the last row, the background
+        out[r:r + rows] = pal[labels[r:r + rows]]
+    return out
@@ -0,0 +1,85 @@
+import bisect
+import numpy as np
+
+
+class Region():
+    # point-in-polygon test for the bounding region, preprocessed once. the
+    # polygon's vertex y values cut the plane into horizontal slabs; inside a
+    # slab the sides crossing it never cross each other, so they are stored
+    # sorted by x and a query is two binary searches, O(log m). the result is
+    # the same even-odd rule as a ray cast towards +x
+    def __init__(self, poly):
+        self.poly = np.asarray(poly, dtype=np.float64).reshape(-1, 2)
+        a = self.poly
+        b = np.roll(self.poly, -1, axis=0)
+        self.ys = np.unique(a[:, 1])
+
+        keep = a[:, 1] != b[:, 1]
+        x3, y3 = a[keep, 0], a[keep, 1]
+        dx = b[keep, 0] - x3
+        dy = b[keep, 1] - y3
+        y4 = b[keep, 1]
+        lo = np.searchsorted(self.ys, np.minimum(y3, y4))
+        hi = np.searchsorted(self.ys, np.maximum(y3, y4))
+        # one entry per (slab, side) the side spans
+        n = hi - lo
+        side = np.repeat(np.arange(len(x3)), n)
+        slab = np.repeat(lo, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        mid = (self.ys[slab] + self.ys[slab + 1]) / 2
+        xm = x3[side] + (mid - y3[side]) * dx[side] / dy[side]
+        o = np.lexsort((xm, slab))
+        side = side[o]
+        slab = slab[o]
+        self.x3 = x3[side]
+        self.y3 = y3[side]
+        self.dx = dx[side]
+        self.dy = dy[side]
+        self.start = np.zeros(max(len(self.ys), 1), dtype=np.int64)
+        np.cumsum(np.bincount(slab, minlength=len(self.ys) - 1), out=self.start[1:])
+        # plain lists for single point queries
+        self.lists = (self.ys.tolist(), self.start.tolist(), self.x3.tolist(), self.y3.tolist(), self.dx.tolist(), self.dy.tolist())
+
+    def xint(self, k, y):
+        return self.x3[k] + (y - self.y3[k]) * self.dx[k] / self.dy[k]
+
+    def contains(self, xy, chunk=1 << 20):
+        # bool mask for an [N,2] array of points
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        res = np.zeros(len(xy), dtype=bool)
+        for s in range(0, len(xy), chunk):
+            res[s:s + chunk] = self.search(xy[s:s + chunk, 0], xy[s:s + chunk, 1])
+        return res
+
+    def search(self, x, y):
+        slab = np.searchsorted(self.ys, y, side='right') - 1
+        ok = (slab >= 0) & (slab < len(self.ys) - 1)
+        slab = np.where(ok, slab, 0)
+        lo = np.where(ok, self.start[slab], 0)
+        end = np.where(ok, self.start[np.minimum(slab + 1, len(self.start) - 1)], 0)
+        hi = end.copy()
+        # first side in the slab whose crossing is right of x
+        while True:
+            act = lo < hi
+            if not act.any():
+                break
+            mid = (lo + hi) // 2
+            k = np.where(act, mid, 0)
+            left = act & (self.xint(k, y) <= x)
+            lo = np.where(left, mid + 1, lo)
+            hi = np.where(act & ~left, mid, hi)
+        return ok & ((end - lo) % 2 == 1)
+
+    def contains_point(self, x, y):
+        ys, start, x3, y3, dx, dy = self.lists
+        s = bisect.bisect_right(ys, y) - 1
+        if s < 0 or s >= len(ys) - 1:
+            return False
+        lo = start[s]
+        end = hi = start[s + 1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if x3[mid] + (y - y3[mid]) * dx[mid] / dy[mid] <= x:
+                lo = mid + 1
+            else:
+                hi = mid
+        return (end - lo) % 2 == 1
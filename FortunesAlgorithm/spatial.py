@@ -0,0 +1,349 @@
+import math
+import numpy as np
+
+
+class SiteIndex():
+    # uniform grid over a set of sites for batched nearest-site queries.
+    # sites are bucketed by cell and stored cell by cell (order/start), a query
+    # searches rings of cells around its own until no unseen cell can be closer
+    def __init__(self, sites, per_cell=0.5):
+        self.sites = np.asarray(sites, dtype=np.float64).reshape(-1, 2)
+        n = len(self.sites)
+        if n == 0:
+            self.lo = np.zeros(2)
+            span = np.ones(2)
+        else:
+            self.lo = self.sites.min(0)
+            span = self.sites.max(0) - self.lo
+        side = max(span.max(), 1e-12)
+        # about per_cell sites per cell, without letting a thin strip of
+        # sites make the cells vanishingly small
+        self.h = max(math.sqrt(span[0] * span[1] * per_cell / max(n, 1)), side * per_cell / max(n, 1), side * 1e-9)
+        self.nx = int(span[0] // self.h) + 1
+        self.ny = int(span[1] // self.h) + 1
+
+        cell = self.cell_of(self.sites)
+        self.order = np.argsort(cell, kind='stable')
+        self.counts = np.bincount(cell, minlength=self.nx * self.ny)
+        self.start = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(self.counts, out=self.start[1:])
+        self.table = None
+
+    def cell_xy(self, pts):
+        cx = np.floor((pts[:, 0] - self.lo[0]) / self.h)
+        cy = np.floor((pts[:, 1] - self.lo[1]) / self.h)
+        cx = np.clip(cx, 0, self.nx - 1).astype(np.int64)
+        cy = np.clip(cy, 0, self.ny - 1).astype(np.int64)
+        return cx, cy
+
+    def cell_of(self, pts):
+        cx, cy = self.cell_xy(pts)
+        return cy * self.nx + cx
+
+    def query(self, pts, k=1, chunk=65536):
+        # k nearest sites of every row of pts, as squared distances and site
+        # indices [M,k] sorted nearest first. missing neighbours are -1 / inf
+        pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+        d2 = np.full((len(pts), k), np.inf)
+        idx = np.full((len(pts), k), -1, dtype=np.int64)
+        if len(self.sites) == 0:
+            return d2, idx
+        for s in range(0, len(pts), chunk):
+            self.search(pts[s:s + chunk], d2[s:s + chunk], idx[s:s + chunk])
+        return d2, idx
+
+    def search(self, pts, best_d2, best_idx):
+        k = best_d2.shape[1]
+        cx, cy = self.cell_xy(pts)
+        # squared distance from each query to the grid box; a cell r rings
+        # away is at least (r-1)*h from the query's projection onto the box
+        hi = self.lo + self.h * np.array([self.nx, self.ny])
+        out2 = ((pts - np.clip(pts, self.lo, hi)) ** 2).sum(1)
+        act = np.arange(len(pts))
+        r = 0
+        while len(act):
+            off = np.array(ring(r))
+            ccx = (cx[act][:, None] + off[:, 0]).ravel()
+            ccy = (cy[act][:, None] + off[:, 1]).ravel()
+            rows = np.repeat(act, len(off))
+            ok = (ccx >= 0) & (ccx < self.nx) & (ccy >= 0) & (ccy < self.ny)
+            cell = ccy[ok] * self.nx + ccx[ok]
+            cnt = self.counts[cell]
+            # expand every (query, cell) pair into (query, site) candidates
+            rows = np.repeat(rows[ok], cnt)
+            slot = np.arange(len(rows)) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+            cand = self.order[np.repeat(self.start[cell], cnt) + slot]
+            d = (self.sites[cand, 0] - pts[rows, 0]) ** 2 + (self.sites[cand, 1] - pts[rows, 1]) ** 2
+            if len(rows):
+                merge(best_d2, best_idx, rows, cand, d)
+            if r >= max(self.nx, self.ny):
+                break
+            act = act[best_d2[act, k - 1] > out2[act] + (r * self.h) ** 2]
+            r += 1
+
+    def within(self, pts, radius):
+        # every site within radius (scalar or per row) of each row of pts, as
+        # CSR arrays (indptr [M+1], indices) sorted nearest first
+        pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+        r2 = np.broadcast_to(np.asarray(radius, dtype=np.float64) ** 2, (len(pts),))
+        cx, cy = self.cell_xy(pts)
+        hi = self.lo + self.h * np.array([self.nx, self.ny])
+        out2 = ((pts - np.clip(pts, self.lo, hi)) ** 2).sum(1)
+        act = np.flatnonzero(out2 <= r2) if len(self.sites) else np.zeros(0, dtype=np.int64)
+        found_rows, found_idx, found_d = [], [], []
+        r = 0
+        while len(act):
+            off = np.array(ring(r))
+            ccx = (cx[act][:, None] + off[:, 0]).ravel()
+            ccy = (cy[act][:, None] + off[:, 1]).ravel()
+            rows = np.repeat(act, len(off))
+            ok = (ccx >= 0) & (ccx < self.nx) & (ccy >= 0) & (ccy < self.ny)
+            cell = ccy[ok] * self.nx + ccx[ok]
+            cnt = self.counts[cell]
+            rows = np.repeat(rows[ok], cnt)
+            slot = np.arange(len(rows)) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+            cand = self.order[np.repeat(self.start[cell], cnt) + slot]
+            d = (self.sites[cand, 0] - pts[rows, 0]) ** 2 + (self.sites[cand, 1] - pts[rows, 1]) ** 2
+            hit = d <= r2[rows]
+            found_rows.append(rows[hit])
+            found_idx.append(cand[hit])
+            found_d.append(d[hit])
+            if r >= max(self.nx, self.ny):
+                break
+            act = act[out2[act] + (r * self.h) ** 2 <= r2[act]]
+            r += 1
+        rows = np.concatenate(found_rows) if found_rows else np.zeros(0, dtype=np.int64)
+        idx = np.concatenate(found_idx) if found_idx else np.zeros(0, dtype=np.int64)
+        d = np.concatenate(found_d) if found_d else np.zeros(0)
+        o = np.lexsort((d, rows))
+        indptr = np.zeros(len(pts) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(pts)), out=indptr[1:])
+        return indptr, idx[o]
+
+    def ties(self, pts, tol):
+        # every site within tol of the nearest distance, for each row of pts
+        pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+        d2 = self.query(pts, 1)[0][:, 0]
+        return self.within(pts, np.sqrt(d2) + tol)
+
+    def nearest(self, pts, chunk=262144):
+        # index of the nearest site for each row of pts. queries inside the
+        # grid only look at their cell's precomputed candidates
+        pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+        res = np.full(len(pts), -1, dtype=np.int64)
+        if len(self.sites) == 0:
+            return res
+        if self.table is None and len(pts) < 2 * len(self.counts):
+            # too few queries to pay for building the cell table
+            return self.query(pts, 1)[1][:, 0]
+        table, table_ok = self.cell_table()
+        hi = self.lo + self.h * np.array([self.nx, self.ny])
+        for s in range(0, len(pts), chunk):
+            p = pts[s:s + chunk]
+            cell = self.cell_of(p)
+            fast = (p >= self.lo).all(1) & (p < hi).all(1) & table_ok[cell]
+            f = np.flatnonzero(fast)
+            cand = table[cell[f]]
+            d = (self.sites[cand, 0] - p[f, 0, None]) ** 2 + (self.sites[cand, 1] - p[f, 1, None]) ** 2
+            d[cand < 0] = np.inf
+            res[s + f] = cand[np.arange(len(f)), d.argmin(1)]
+            slow = np.flatnonzero(~fast)
+            if len(slow):
+                res[s + slow] = self.query(p[slow], 1)[1][:, 0]
+        return res
+
+    def nearest_point(self, x, y):
+        # nearest for a single point, without building query arrays
+        if len(self.sites) == 0:
+            return -1
+        table, table_ok = self.cell_table()
+        cx = math.floor((x - self.lo[0]) / self.h)
+        cy = math.floor((y - self.lo[1]) / self.h)
+        if 0 <= cx < self.nx and 0 <= cy < self.ny and table_ok[cy * self.nx + cx]:
+            cand = table[cy * self.nx + cx]
+            cand = cand[cand >= 0]
+            d = (self.sites[cand, 0] - x) ** 2 + (self.sites[cand, 1] - y) ** 2
+            return int(cand[d.argmin()])
+        return int(self.query([(x, y)], 1)[1][0, 0])
+
+    def cell_table(self, width=16):
+        # for every grid cell, the sites that can be nearest to some point in
+        # it. with s0 the site nearest the cell's centre and B its distance to
+        # the farthest corner, only sites within B of the cell qualify. rows
+        # are padded with -1, cells with more than width candidates fall back
+        # to the ring search
+        if self.table is None:
+            gx, gy = np.meshgrid(np.arange(self.nx), np.arange(self.ny))
+            lo = np.column_stack((gx.ravel(), gy.ravel())) * self.h + self.lo
+            centres = lo + self.h / 2
+            # cells with no site within 3 cells (an empty corner of the
+            # region) would gather more than width candidates anyway, they are
+            # left to the ring search without searching for them here
+            occ = np.pad(self.counts.reshape(self.ny, self.nx) > 0, 3).cumsum(0).cumsum(1)
+            occ = np.pad(occ, ((1, 0), (1, 0)))
+            block = occ[7:, 7:] - occ[:-7, 7:] - occ[7:, :-7] + occ[:-7, :-7]
+            close = np.flatnonzero(block.ravel() > 0)
+            s0 = self.sites[self.query(centres[close], 1)[1][:, 0]]
+            far = np.abs(s0 - centres[close]) + self.h / 2
+            bound = np.full(len(centres), np.inf)
+            bound[close] = np.sqrt((far ** 2).sum(1))
+            radius = bound + self.h * math.sqrt(0.5)
+            close = np.flatnonzero(radius <= 4 * self.h)
+            indptr, idx = self.within(centres[close], radius[close])
+            counts = np.diff(indptr)
+            rows = close[np.repeat(np.arange(len(close)), counts)]
+            near = np.clip(self.sites[idx], lo[rows], lo[rows] + self.h)
+            keep = ((near - self.sites[idx]) ** 2).sum(1) <= bound[rows] ** 2
+            rows = rows[keep]
+            idx = idx[keep]
+            counts = np.bincount(rows, minlength=len(centres))
+            w = int(min(counts.max(), width))
+            ok = (counts <= w) & (radius <= 4 * self.h)
+            table = np.full((len(centres), w), -1, dtype=np.int32)
+            col = np.arange(len(idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+            keep = ok[rows]
+            table[rows[keep], col[keep]] = idx[keep]
+            self.table = (table, ok)
+        return self.table
+
+def merge(best_d2, best_idx, rows, cand, d):
+    # folds candidates into the sorted per-row best lists. rows arrive
+    # grouped (each query's candidates are contiguous)
+    k = best_d2.shape[1]
+    new = np.ones(len(rows), dtype=bool)
+    new[1:] = rows[1:] != rows[:-1]
+    group = np.flatnonzero(new)
+    if k == 1:
+        gmin = np.minimum.reduceat(d, group)
+        sizes = np.diff(np.append(group, len(rows)))
+        pos = np.where(d == np.repeat(gmin, sizes), np.arange(len(rows)), len(rows))
+        pos = np.minimum.reduceat(pos, group)
+        rows = rows[group]
+        better = gmin < best_d2[rows, 0]
+        best_d2[rows[better], 0] = gmin[better]
+        best_idx[rows[better], 0] = cand[pos[better]]
+        return
+    touched = rows[group]
+    rows = np.concatenate((rows, np.repeat(touched, k)))
+    cand = np.concatenate((cand, best_idx[touched].ravel()))
+    d = np.concatenate((d, best_d2[touched].ravel()))
+    o = np.lexsort((d, rows))
+    rows = rows[o]
+    new = np.ones(len(rows), dtype=bool)
+    new[1:] = rows[1:] != rows[:-1]
+    group = np.flatnonzero(new)
+    rank = np.arange(len(rows)) - np.repeat(group, np.diff(np.append(group, len(rows))))
+    keep = rank < k
+    best_d2[rows[keep], rank[keep]] = d[o][keep]
+    best_idx[rows[keep], rank[keep]] = cand[o][keep]
+
+
+def ring(r):
+    # cell offsets at Chebyshev distance exactly r
+    if r == 0:
+        return [(0, 0)]
+    out = [(dx, -r) for dx in range(-r, r + 1)] + [(dx, r) for dx in range(-r, r + 1)]
+    out += [(-r, dy) for dy in range(-r + 1, r)] + [(r, dy) for dy in range(-r + 1, r)]
+    return out
+
+
+class SiteGrid():
+    # bucket grid over a changing set of sites, for the local searches of
+    # Voronoi's edits. buckets are dict entries so adding and removing a site
+    # is O(1) and a search only touches the buckets it overlaps
+    def __init__(self, h):
+        self.h = h
+        self.buckets = {}
+
+    def key(self, x, y):
+        return (math.floor(x / self.h), math.floor(y / self.h))
+
+    def insert(self, row, x, y):
+        self.buckets.setdefault(self.key(x, y), []).append((row, x, y))
+
+    def remove(self, row, x, y):
+        k = self.key(x, y)
+        self.buckets[k].remove((row, x, y))
+        if len(self.buckets[k]) == 0:
+            del self.buckets[k]
+
+    def within(self, x, y, r):
+        # rows of the sites closer than r to (x, y)
+        return [row for d2, row in self.scan(x, y, r)]
+
+    def nearest(self, x, y):
+        # row of the site nearest (x, y), or None if there are none. the
+        # search radius doubles until it finds a site
+        if len(self.buckets) == 0:
+            return None
+        r = self.h
+        while True:
+            near = self.scan(x, y, r)
+            if len(near):
+                return min(near)[1]
+            r *= 2
+
+    def scan(self, x, y, r):
+        # (squared distance, row) of the sites closer than r to (x, y)
+        kx0, ky0 = self.key(x - r, y - r)
+        kx1, ky1 = self.key(x + r, y + r)
+        if (kx1 - kx0 + 1) * (ky1 - ky0 + 1) > len(self.buckets):
+            keys = list(self.buckets.keys())
+        else:
+            keys = [(i, j) for i in range(kx0, kx1 + 1) for j in range(ky0, ky1 + 1)]
+        r2 = r * r
+        out = []
+        for k in keys:
+            for row, sx, sy in self.buckets.get(k, ()):
+                d2 = (sx - x) ** 2 + (sy - y) ** 2
+                if d2 < r2:
+                    out.append((d2, row))
+        return out
+
+
+class SegmentIndex():
+    # uniform grid over the bounding boxes of a set of segments ([E,4] as
+    # x0, y0, x1, y1), for finding the segments near a rectangle. the grid
+    # covers lo..hi, segments reaching past it are clamped to its border cells
+    # so they are still found there. each segment is listed in every cell its
+    # box overlaps, cell by cell (order/start)
+    def __init__(self, segments, lo, hi, per_cell=1.0):
+        self.segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        n = len(self.segments)
+        self.lo = np.asarray(lo, dtype=np.float64)
+        span = np.maximum(np.asarray(hi, dtype=np.float64) - self.lo, 1e-12)
+        self.h = max(math.sqrt(span[0] * span[1] * per_cell / max(n, 1)), span.max() * 1e-9)
+        self.nx = int(span[0] // self.h) + 1
+        self.ny = int(span[1] // self.h) + 1
+
+        s = self.segments
+        x0, x1, y0, y1 = self.cells(np.minimum(s[:, 0], s[:, 2]), np.maximum(s[:, 0], s[:, 2]),
+                                    np.minimum(s[:, 1], s[:, 3]), np.maximum(s[:, 1], s[:, 3]))
+        w = x1 - x0 + 1
+        cnt = w * (y1 - y0 + 1)
+        # one (cell, segment) pair per cell a box covers
+        seg = np.repeat(np.arange(n), cnt)
+        k = np.arange(cnt.sum()) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+        cell = (np.repeat(y0, cnt) + k // np.repeat(w, cnt)) * self.nx + np.repeat(x0, cnt) + k % np.repeat(w, cnt)
+        o = np.argsort(cell, kind='stable')
+        self.order = seg[o]
+        self.start = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=self.nx * self.ny), out=self.start[1:])
+
+    def cells(self, x0, x1, y0, y1):
+        # grid cell ranges (inclusive, clamped) covering the given boxes
+        cx = np.clip(np.floor((np.array([x0, x1]) - self.lo[0]) / self.h), 0, self.nx - 1).astype(np.int64)
+        cy = np.clip(np.floor((np.array([y0, y1]) - self.lo[1]) / self.h), 0, self.ny - 1).astype(np.int64)
+        return cx[0], cx[1], cy[0], cy[1]
+
+    def query(self, x0, x1, y0, y1):
+        # indices of the segments whose boxes may overlap the rectangle,
+        # ascending
+        if len(self.segments) == 0:
+            return np.zeros(0, dtype=np.int64)
+        a, b, c, d = self.cells(x0, x1, y0, y1)
+        gy, gx = np.mgrid[c:d + 1, a:b + 1]
+        cell = (gy * self.nx + gx).ravel()
+        cnt = self.start[cell + 1] - self.start[cell]
+        k = np.repeat(self.start[cell], cnt) + np.arange(cnt.sum()) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+        return np.unique(self.order[k])
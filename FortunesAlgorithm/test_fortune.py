@@ -0,0 +1,426 @@
+import numpy as np
+import pytest
+from fortune import Voronoi
+
+
+# checks of the finished diagram. most of them compare areas: the cells of a
+# bound diagram tile the region, so their areas add up to the region's, and a
+# dropped, doubled or wrongly closed side shows up as a difference
+
+def area(poly):
+    p = np.asarray(poly, dtype=np.float64).reshape(-1, 2)
+    q = np.roll(p, -1, axis=0)
+    return (p[:, 0] * q[:, 1] - q[:, 0] * p[:, 1]).sum() / 2
+
+
+def cell_areas(rows, indptr, xy):
+    return np.array([area(xy[indptr[i]:indptr[i + 1]]) for i in range(len(rows))])
+
+
+def built(points, box=None):
+    v = Voronoi(points, box)
+    v.bind()
+    v.assignLines()
+    return v
+
+
+def test_array_box():
+    # a bounding box given as an array builds the same diagram as a list
+    box = [(0, 0), (500, 0), (500, 500), (250, 200), (0, 500)]
+    pts = np.random.default_rng(7).uniform(0, 500, (300, 2))
+    a = built(pts, box)
+    b = Voronoi.from_array(pts, np.array(box, dtype=np.float64))
+    b.bind()
+    b.assignLines()
+    for x, y in zip(a.polygon_arrays(), b.polygon_arrays()):
+        assert np.array_equal(x, y)
+
+
+COLLINEAR = {
+    'horizontal': [(100, 250), (250, 250), (400, 250)],
+    'vertical': [(250, 50 + 100 * i) for i in range(5)],
+    'diagonal': [(10 + 9.0 * i, 10 + 9.0 * i) for i in range(50)],
+    'antidiagonal': [(10 + 20.0 * i, 480 - 20.0 * i) for i in range(20)],
+    'sloped': [(10 + 23.0 * i, 100 + 7.0 * i) for i in range(20)],
+    'pair': [(100, 100), (300, 400)],
+}
+
+
+@pytest.mark.parametrize('name', sorted(COLLINEAR))
+def test_collinear_cells(name):
+    # every cell lies between two parallel edges with no vertex joining them
+    v = built(COLLINEAR[name])
+    a = cell_areas(*v.polygon_arrays())
+    assert (a > 0).all()
+    assert a.sum() == pytest.approx(500 * 500)
+
+
+def test_collinear_middle_cell():
+    v = built(COLLINEAR['horizontal'])
+    assert sorted(v.verts[(250.0, 250.0)]) == sorted([(175.0, 500.0), (175.0, 250.0), (175.0, 0.0), (325.0, 0.0),
+                                                     (325.0, 250.0), (325.0, 500.0), (175.0, 500.0)])
+    mid = v.points_used[[p.index for p in v.points_used].index(1)]
+    assert [p.index for p in v.neighbors(mid)] == [0, 2]
+
+
+@pytest.mark.parametrize('bound', [False, True])
+def test_neighbors_once_each(bound):
+    # the two half-edges an edge starts as give one neighbour, and the walk
+    # agrees with the CSR graph over the unclipped diagram
+    v = Voronoi(np.random.default_rng(1).uniform(0, 500, (500, 2)))
+    indptr, indices = v.neighbor_arrays()[:2]
+    if bound:
+        v.bind()
+    for p in v.points_used:
+        n = [q.index for q in v.neighbors(p)]
+        assert len(n) == len(set(n))
+        assert sorted(n) == indices[indptr[p.index]:indptr[p.index + 1]].tolist()
+
+
+NOTCHED = [(150, 150), (150, 750), (300, 400), (1400, 750), (1300, 300)]
+
+
+@pytest.mark.parametrize('seed', [12, 25])
+def test_concave_box_splits_cells(seed):
+    # the notch at (300, 400) cuts a cell in two, each piece is its own loop
+    from sampling import uniform
+    v = built(uniform(50, [(0, 0), (0, 900), (1500, 900), (1500, 0)], seed=seed, integer=True), NOTCHED)
+    rows, indptr, xy = v.polygon_arrays()
+    a = cell_areas(rows, indptr, xy)
+    assert len(rows) > len(set(rows.tolist()))
+    assert (a > 0).all()
+    assert a.sum() == pytest.approx(abs(area(NOTCHED)))
+    # no side cuts across the outside of the region
+    mid = np.vstack([(xy[s + 1:e] + xy[s:e - 1]) / 2 for s, e in zip(indptr[:-1], indptr[1:])])
+    assert (v.region.contains(mid) | (boundary_distance(NOTCHED, mid) < 1e-9)).all()
+
+
+def boundary_distance(poly, pts):
+    p = np.asarray(poly, dtype=np.float64)
+    q = np.roll(p, -1, axis=0)
+    d = q - p
+    w = np.clip(((pts[:, None] - p) * d).sum(2) / (d * d).sum(1), 0, 1)
+    return np.sqrt(((p + w[..., None] * d - pts[:, None]) ** 2).sum(2)).min(1)
+
+
+def test_cocircular_cells_stay_whole():
+    # integer sites put several sites on one circle, the zero-length sides
+    # between them must not end a cell's loop early
+    pts = np.unique(np.random.default_rng(2).integers(0, 500, (3000, 2)).astype(np.float64), axis=0)
+    rows, indptr, xy = built(pts).polygon_arrays()
+    assert len(rows) == len(set(rows.tolist())) == len(pts)
+    assert cell_areas(rows, indptr, xy).sum() == pytest.approx(500 * 500)
+
+
+@pytest.mark.parametrize('angle', [0.0, 0.5, np.pi / 6, np.pi / 4])
+def test_rotated_lattice(angle):
+    # every voronoi vertex of a square lattice has four cocircular sites, and
+    # rotation keeps them all off the float grid
+    i, j = np.mgrid[0:20, 0:20]
+    g = np.column_stack((i.ravel(), j.ravel())) * 15.0 - 142.5
+    c, s = np.cos(angle), np.sin(angle)
+    pts = g @ np.array([[c, s], [-s, c]]) + 250
+    rows, indptr, xy = built(pts).polygon_arrays()
+    a = cell_areas(rows, indptr, xy)
+    assert len(rows) == len(set(rows.tolist())) == len(pts)
+    assert (a > 0).all()
+    assert a.sum() == pytest.approx(500 * 500)
+
+
+MASKS = [
+    [(10, 10), (200, 10), (200, 200), (10, 200)],
+    [(100, 100), (400, 120), (250, 260), (450, 450), (80, 400)],
+    [(300, 300), (300, 480), (480, 480), (480, 300)][::-1],
+    [(0, 0), (500, 0), (500, 500), (0, 500)],
+    [(0, 0), (500, 0), (500, 500), (250, 200), (0, 500)],
+]
+
+
+@pytest.mark.parametrize('bound', [False, True])
+def test_mask_area(bound):
+    # the cells inside each mask cover it exactly. masks sharing sides with
+    # the box of a bound diagram meet segment ends right on those sides
+    v = Voronoi(np.random.default_rng(3).uniform(0, 500, (2000, 2)))
+    if bound:
+        v.bind()
+    for mask, (rows, indptr, xy, edges, edge_sites) in zip(MASKS, v.clip_masks(MASKS)):
+        a = cell_areas(rows, indptr, xy)
+        assert (np.diff(indptr) >= 3).all()
+        assert (a > 0).all()
+        assert a.sum() == pytest.approx(abs(area(mask)))
+
+
+def test_mask_empty_diagram():
+    # no sites give no cells, and one site's cell is the whole mask
+    rows, indptr, xy, edges, edge_sites = Voronoi([]).clip_masks(MASKS[:1])[0]
+    assert len(rows) == len(xy) == len(edges) == len(edge_sites) == 0
+    assert indptr.tolist() == [0]
+    rows, indptr, xy, edges, edge_sites = Voronoi([(50, 50)]).clip_masks(MASKS[1:2])[0]
+    assert rows.tolist() == [0]
+    assert len(edges) == 0
+    assert abs(area(xy)) == pytest.approx(abs(area(MASKS[1])))
+
+
+def pair_lengths(v, rows=None):
+    # total length of the segments between each pair of sites
+    out = {}
+    ends, edges, edge_sites = v.output_arrays()
+    if rows is not None:
+        edge_sites = rows[edge_sites]
+    d = np.sqrt(((ends[edges[:, 0]] - ends[edges[:, 1]]) ** 2).sum(1))
+    for (a, b), l in zip(np.sort(edge_sites, axis=1).tolist(), d.tolist()):
+        out[(a, b)] = out.get((a, b), 0.0) + l
+    return out
+
+
+@pytest.mark.parametrize('box', [None, [(0, 0), (500, 0), (500, 500), (250, 200), (0, 500)]])
+def test_neighbor_edges_index_segments(box):
+    # edge numbers from neighbor_arrays gather the segments of output_arrays
+    v = built(np.random.default_rng(6).uniform(0, 500, (500, 2)), box)
+    indptr, indices, edge, pairs, seg_edge = v.neighbor_arrays()
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    assert np.array_equal(pairs[edge], np.sort(np.column_stack((rows, indices)), axis=1))
+    ends, edges, edge_sites = v.output_arrays()
+    assert np.array_equal(pairs[seg_edge], np.sort(edge_sites, axis=1))
+    d = np.sqrt(((ends[edges[:, 0]] - ends[edges[:, 1]]) ** 2).sum(1))
+    lengths = pair_lengths(v)
+    assert np.allclose(np.bincount(seg_edge, d, len(pairs)), [lengths[k] for k in map(tuple, pairs.tolist())])
+
+
+def test_cocircular_square_neighbors():
+    # the diagonal cells of a square meet only at its centre
+    v = built([(100, 100), (300, 100), (100, 300), (300, 300)])
+    indptr, indices, edge, pairs, seg_edge = v.neighbor_arrays()
+    assert pairs.tolist() == [[0, 1], [0, 2], [1, 3], [2, 3]]
+    assert [indices[indptr[i]:indptr[i + 1]].tolist() for i in range(4)] == [[1, 2], [0, 3], [0, 3], [1, 2]]
+    ends, edges = v.output_arrays()[:2]
+    assert (seg_edge[(ends[edges[:, 0]] == ends[edges[:, 1]]).all(1)] == -1).all()
+    for p in v.points_used:
+        assert sorted(q.index for q in v.neighbors(p)) == indices[indptr[p.index]:indptr[p.index + 1]].tolist()
+
+
+def test_integer_neighbors_match_parallel():
+    # integer sites put many sites on one circle, both build paths give the
+    # same graph
+    from sampling import uniform
+    pts = uniform(1500, None, seed=3, integer=True)
+    a = built(pts).neighbor_arrays()
+    b = Voronoi.parallel(pts, None, workers=1, strips=3).neighbor_arrays()
+    for x, y in zip(a[:2], b[:2]):
+        assert np.array_equal(x, y)
+
+
+@pytest.mark.parametrize('box', [None, [(0, 0), (500, 0), (500, 500), (250, 200), (0, 500)]])
+def test_edits_match_rebuild(box):
+    rng = np.random.default_rng(5)
+    v = built(rng.uniform(0, 500, (300, 2)), box)
+    v.dynamic()
+    for it in range(40):
+        live = sorted(v.site_at)
+        op = it % 3
+        if op == 0:
+            v.add_site(*rng.uniform(0, 500, 2))
+        elif op == 1:
+            v.remove_site(live[rng.integers(len(live))])
+        else:
+            r = live[rng.integers(len(live))]
+            v.move_site(r, *(v.sites[r] + rng.normal(0, 20, 2)).clip(1, 499))
+    rows = np.array(sorted(v.site_at))
+    w = built(v.sites[rows], box)
+    # the same cells
+    ra, ia, xa = v.polygon_arrays()
+    rb, ib, xb = w.polygon_arrays()
+    n = len(v.sites)
+    assert np.array_equal(np.unique(ra), rows)
+    assert np.allclose(np.bincount(ra, cell_areas(ra, ia, xa), n), np.bincount(rows[rb], cell_areas(rb, ib, xb), n))
+    # and the same segments between the same sites
+    la = pair_lengths(v)
+    lb = pair_lengths(w, rows)
+    assert la.keys() == lb.keys()
+    assert np.allclose([la[k] for k in la], [lb[k] for k in la])
+    assert len(v.to_diagram().vertices) == len(w.to_diagram().vertices)
+    # the half-edges and triangles are not updated
+    with pytest.raises(ValueError):
+        v.delaunay_triangles()
+    with pytest.raises(ValueError):
+        v.neighbors(v.points_used[0])
+
+
+@pytest.mark.parametrize('box', [None, [(0, 0), (500, 0), (500, 500), (250, 200), (0, 500)]])
+def test_parallel_matches_sweep(box):
+    from sampling import uniform
+    pts = uniform(2000, box, seed=4)
+    a = built(pts, box)
+    b = Voronoi.parallel(pts, box, workers=1, strips=3)
+    n = len(pts)
+    ra, ia, xa = a.polygon_arrays()
+    rb, ib, xb = b.polygon_arrays()
+    assert np.allclose(np.bincount(ra, cell_areas(ra, ia, xa), n), np.bincount(rb, cell_areas(rb, ib, xb), n))
+    for x, y in zip(a.neighbor_arrays()[:2], b.neighbor_arrays()[:2]):
+        assert np.array_equal(x, y)
+    # nothing is left to sweep, and there is no topology to hand out
+    lines = len(b.lines)
+    b.process()
+    assert len(b.lines) == lines
+    with pytest.raises(ValueError):
+        b.delaunay_triangles()
+
+
+@pytest.mark.parametrize('integer', [False, True])
+def test_uniform_sites_are_distinct(integer):
+    # a small integer box forces many repeats among the candidates
+    from sampling import uniform
+    from region import Region
+    box = [(0, 0), (0, 60), (60, 60), (60, 0)]
+    pts = uniform(3000, box, seed=1, integer=integer)
+    assert len(pts) == 3000
+    assert len(np.unique(pts, axis=0)) == 3000
+    assert Region(box).contains(pts).all()
+    assert np.array_equal(pts, uniform(3000, box, seed=1, integer=integer))
+
+
+def test_streamed_edges():
+    # edges() hands out the segments of the full sweep, emit gets the same,
+    # and with clip only the pieces inside the region are left
+    pts = np.random.default_rng(8).uniform(0, 500, (400, 2))
+    whole = Voronoi(pts)
+    ends, edges, edge_sites = whole.output_arrays()
+    want = sorted(tuple(e) + (i, j) for e, (i, j) in zip(whole.output(), edge_sites.tolist()))
+    assert sorted(Voronoi(pts, stream=True).edges(batch=16)) == want
+    got = []
+    Voronoi(pts, emit=got.append)
+    assert sorted(got) == want
+    box = [(0, 0), (500, 0), (500, 500), (250, 200), (0, 500)]
+    bound = built(pts, box)
+    lengths = pair_lengths(bound)
+    clipped = {}
+    for x0, y0, x1, y1, i, j in Voronoi(pts, box, stream=True, clip=True).edges():
+        k = (min(i, j), max(i, j))
+        clipped[k] = clipped.get(k, 0.0) + np.hypot(x1 - x0, y1 - y0)
+    assert clipped.keys() == lengths.keys()
+    assert np.allclose([clipped[k] for k in lengths], [lengths[k] for k in lengths])
+
+
+def test_stats_and_hook():
+    # every event is counted and passed to the hook, and the counters add up
+    pts = np.random.default_rng(9).uniform(0, 500, (400, 2))
+    seen = []
+    v = Voronoi(pts, stats=True, hook=lambda kind, x, y, payload: seen.append((kind, x)))
+    n = len(v.lines)
+    v.bind()
+    st = v.stats
+    assert st['site_events'] == len(v.points_used)
+    assert st['circle_pushed'] == st['circle_events'] + st['circle_invalidated']
+    assert st['circle_events'] == len(v.delaunay_triangles())
+    assert st['segments'] == n
+    assert n - st['segments_dropped'] + st['segments_split'] == len(v.lines)
+    assert 0 < st['beach_max'] <= len(pts) * 2
+    assert {'process', 'finish_edges', 'bind'} <= set(st['time'])
+    assert [k for k, x in seen].count('site') == st['site_events']
+    assert [k for k, x in seen].count('circle') == st['circle_events']
+    assert all(a <= b for a, b in zip([x for k, x in seen], [x for k, x in seen][1:]))
+    # and the diagram is the one built without them
+    assert Voronoi(pts).output() == Voronoi(pts, stats=True).output()
+
+
+def test_cache_hit_and_evict(tmp_path):
+    import os
+    from cache import DiagramCache, diagram_key
+    rng = np.random.default_rng(10)
+    sets = [rng.uniform(0, 500, (200, 2)) for i in range(3)]
+    cache = DiagramCache(str(tmp_path))
+    d = cache.diagram(sets[0])
+    key = diagram_key(sets[0])
+    assert os.path.exists(cache.entry(key))
+    # a hit is the stored diagram, read back from disk
+    e = cache.diagram(sets[0])
+    for name, a in d.arrays().items():
+        assert np.array_equal(a, getattr(e, name))
+    assert isinstance(e.vertices, np.memmap)
+    assert diagram_key(sets[0], [(0, 0), (0, 9), (9, 9)]) != key
+    assert diagram_key(sets[0], tol=1e-3) != key
+    # room for two entries, the least recently used goes first
+    size = os.path.getsize(cache.entry(key))
+    cache.max_bytes = 2 * size + size // 2
+    cache.diagram(sets[1])
+    os.utime(cache.entry(diagram_key(sets[1])), (1, 1))
+    cache.get(key)
+    cache.diagram(sets[2])
+    assert sorted(os.listdir(str(tmp_path))) == sorted(diagram_key(s) + '.diagram' for s in (sets[0], sets[2]))
+
+
+@pytest.mark.parametrize('box', [None, [(0, 0), (500, 0), (500, 500), (250, 200), (0, 500)]])
+def test_locate_nearest_site(box):
+    # a point's cell is its nearest site's, -1 outside the region
+    from region import Region
+    rng = np.random.default_rng(11)
+    v = Voronoi(rng.uniform(0, 500, (300, 2)), box)
+    q = rng.uniform(-50, 550, (2000, 2))
+    got = v.locate(q)
+    rows = np.array([p.index for p in v.points_used])
+    d = ((q[:, None] - v.sites[rows][None]) ** 2).sum(2)
+    want = np.where(Region(v.box_vert).contains(q), rows[d.argmin(1)], -1)
+    assert got.dtype == np.int32
+    assert np.array_equal(got, want)
+    assert [v.locate_point(x, y) for x, y in q[:100].tolist()] == want[:100].tolist()
+    assert np.array_equal(Voronoi([]).locate(q), np.full(len(q), -1))
+
+
+def test_diagram_round_trip(tmp_path):
+    # save/load, with and without mmap, and pickle 5 with out-of-band
+    # buffers give back the same arrays
+    import pickle
+    d = built(np.random.default_rng(12).uniform(0, 500, (300, 2))).to_diagram()
+    # every vertex once, and cells close without repeating their first
+    assert len(np.unique(d.vertices, axis=0)) == len(d.vertices)
+    assert (d.polygon(0)[0] != d.polygon(0)[-1]).any()
+    path = str(tmp_path / 'd.diagram')
+    d.save(path)
+    buffers = []
+    data = pickle.dumps(d, protocol=5, buffer_callback=buffers.append)
+    assert len(buffers) == len(d.arrays())
+    for e in (d.load(path), d.load(path, mmap=False), pickle.loads(data, buffers=buffers)):
+        for name, a in d.arrays().items():
+            b = getattr(e, name)
+            assert a.dtype == b.dtype
+            assert np.array_equal(a, b)
+    assert isinstance(d.load(path).edges, np.memmap)
+    with open(path, 'r+b') as f:
+        f.write(b'X')
+    with pytest.raises(ValueError):
+        d.load(path)
+
+
+@pytest.mark.parametrize('box', [None, [(0, 0), (500, 0), (500, 500), (250, 200), (0, 500)]])
+def test_poisson_disk(box):
+    # sites are radius apart, no room is left for another, and a seed gives
+    # the same sites
+    from sampling import poisson_disk, bounds
+    r = 16.0
+    pts = poisson_disk(r, box, seed=1)
+    region = bounds(box)[0]
+    assert region.contains(pts).all()
+    d = np.sqrt(((pts[:, None] - pts[None]) ** 2).sum(2))
+    np.fill_diagonal(d, np.inf)
+    assert d.min() >= r
+    g = np.mgrid[0:500:2.5, 0:500:2.5].reshape(2, -1).T + 1.25
+    g = g[region.contains(g)]
+    assert np.sqrt(((g[:, None] - pts[None]) ** 2).sum(2)).min(1).max() < r
+    assert np.array_equal(pts, poisson_disk(r, box, seed=1))
+    assert not np.array_equal(pts, poisson_disk(r, box, seed=2))
+
+
+def test_label_image(tmp_path):
+    # each pixel centre is labelled with its nearest site, -1 outside the
+    # region, and no sites give an image of -1
+    box = [(0, 0), (500, 0), (500, 500), (250, 200), (0, 500)]
+    v = Voronoi(np.random.default_rng(13).uniform(0, 500, (200, 2)), box)
+    lab = v.label_image(50, 40, (0, 500, 0, 500))
+    assert lab.shape == (40, 50)
+    c = np.column_stack((np.tile((np.arange(50) + 0.5) * 10, 40), np.repeat((np.arange(40) + 0.5) * 12.5, 50)))
+    assert np.array_equal(lab.ravel(), v.locate(c))
+    path = str(tmp_path / 'lab.npy')
+    v.label_image(50, 40, (0, 500, 0, 500), out=path)
+    assert np.array_equal(np.load(path), lab)
+    assert (Voronoi([]).label_image(4, 4) == -1).all()
+    assert (Voronoi([], box).label_image(4, 4, out=path) == -1).all()
@@ -0,0 +1,84 @@
+import math
+from decimal import Decimal, localcontext
+from fractions import Fraction
+import numpy as np
+import pytest
+from predicates import orient, orient_exact, circumcenter, circle_x, breakpoint_y
+
+
+# the predicates against exact arithmetic, on the inputs where floats alone
+# get them wrong
+
+
+def test_orient_repeated_coordinates():
+    assert orient(1.0, 1.0, 1.0, 1.0, 5.0, 7.0) == 0
+    assert orient(0.0, 3.0, 2.0, 3.0, 9.0, 3.0) == 0
+    assert orient(4.0, 0.0, 4.0, 2.0, 4.0, -6.0) == 0
+    assert orient(0.0, 0.0, 1.0, 0.0, 0.0, 1.0) == 1
+    assert orient(0.0, 0.0, 0.0, 1.0, 1.0, 0.0) == -1
+
+
+def test_orient_near_collinear():
+    # points a few ulps around the line y = x, where the float determinant
+    # is pure rounding error
+    ulp = 2.0 ** -53
+    for i in range(64):
+        for j in range(64):
+            p = (0.5 + i * ulp, 0.5 + j * ulp, 12.0, 12.0, 24.0, 24.0)
+            assert orient(*p) == orient_exact(*p)
+
+
+def test_orient_collinear_floats():
+    # on one line exactly, though none of the coordinates repeat
+    rng = np.random.default_rng(0)
+    for k in rng.integers(1, 1 << 20, (200, 3)).tolist():
+        p = [Fraction(k[0], 1 << 20), Fraction(k[1], 1 << 20), Fraction(k[2], 1 << 20)]
+        pts = [(float(3 * t + 1), float(5 * t - 2)) for t in p]
+        assert orient(*pts[0], *pts[1], *pts[2]) == 0
+
+
+def exact_center(ax, ay, bx, by, cx, cy):
+    ax, ay, bx, by, cx, cy = map(Fraction, (ax, ay, bx, by, cx, cy))
+    A, B, C, D = bx - ax, by - ay, cx - ax, cy - ay
+    G = 2 * (A * D - C * B)
+    return ax + (D * (A * A + B * B) - B * (C * C + D * D)) / G, ay + (A * (C * C + D * D) - C * (A * A + B * B)) / G
+
+
+@pytest.mark.parametrize('dy', [1e-3, 1e-7, 1e-10, 2.0 ** -40])
+def test_circumcenter_near_collinear(dy):
+    # the middle point only just off the line, the centre is far away
+    p = (0.1, 0.3, 250.7, 0.3 + dy, 500.3, 0.3)
+    x, y = circumcenter(*p)
+    ex, ey = exact_center(*p)
+    assert x == pytest.approx(float(ex), rel=1e-12)
+    assert y == pytest.approx(float(ey), rel=1e-12)
+
+
+@pytest.mark.parametrize('ox', [-1e3, -1e8, -1e12])
+def test_circle_x_far_centre(ox):
+    # ox + r cancels almost every digit, the answer should still be within
+    # rounding of the exact one
+    ax, ay, oy = 3.0, 7.25, 0.5
+    with localcontext() as ctx:
+        ctx.prec = 60
+        exact = Decimal(ox) + ((Decimal(ax) - Decimal(ox)) ** 2 + (Decimal(ay) - Decimal(oy)) ** 2).sqrt()
+    x = circle_x(ax, ay, ox, oy)
+    assert x > ax
+    assert abs(Decimal(x) - exact) <= Decimal(4 * math.ulp(ax))
+
+
+def test_breakpoint_equal_x():
+    # sites level with each other meet halfway, wherever the sweep is
+    for l in (5.0, 7.5, 1e6):
+        assert breakpoint_y(2.0, 1.0, 2.0, 9.0, l) == 5.0
+
+
+@pytest.mark.parametrize('l', [3.0 + 2.0 ** -40, 3.5, 10.0, 1e5])
+def test_breakpoint_equidistant(l):
+    # the breakpoint is as far from both sites as from the sweep
+    p0x, p0y, p1x, p1y = 1.0, 2.0, 3.0, 4.0
+    y = breakpoint_y(p0x, p0y, p1x, p1y, l)
+    x = (p0x ** 2 + (p0y - y) ** 2 - l ** 2) / (2 * p0x - 2 * l)
+    d = l - x
+    assert math.hypot(x - p0x, y - p0y) == pytest.approx(d, rel=1e-9, abs=1e-9)
+    assert math.hypot(x - p1x, y - p1y) == pytest.approx(d, rel=1e-9, abs=1e-9)
@@ -0,0 +1,160 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from fortune import Voronoi
+from region import Region
+from spatial import SiteIndex
+
+
+# tiled generation of large diagrams. the bounding region is cut into a grid
+# of tiles and every tile is swept on its own, in a worker process, from the
+# sites inside it plus a halo of neighbouring sites. a tile only keeps the
+# cells of its own sites, and only those it can certify: a cell is exact when
+# the circle about each of its vertices through its site lies inside the
+# area the tile was given sites for, since then no missing site can be
+# closer. cells that fail go back out with a doubled halo. the cells are
+# then stitched with vertices on the seams merged
+
+
+def tiled_cells(points, bounding_box=None, tiles=(4, 4), workers=None, halo=None, tol=None):
+    # cells of every site inside the region, as (vertices [V,2], rows [C],
+    # indptr [C+1], indices [K]): cell i belongs to site rows[i] and runs
+    # through vertices[indices[indptr[i]:indptr[i+1]]]. workers=1 runs the
+    # tiles in this process. tol is how close two vertices must be to be
+    # merged, by default a tiny fraction of the region's size
+    sites = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if bounding_box is None:
+        bounding_box = [(0, 0), (500, 0), (500, 500), (0, 500)]
+    box = [tuple(p) for p in bounding_box]
+    poly = np.array(box, dtype=np.float64)
+    lo = poly.min(0)
+    hi = poly.max(0)
+    if tol is None:
+        tol = (hi - lo).max() * 1e-9
+
+    live = np.flatnonzero(Region(box).contains(sites))
+    if halo is None:
+        area = (hi - lo).prod()
+        halo = 4 * math.sqrt(area / max(len(live), 1))
+    # extent of the live sites, a tile's halo reaching past it is left open
+    if len(live):
+        span_lo = sites[live].min(0)
+        span_hi = sites[live].max(0)
+    else:
+        span_lo = span_hi = lo
+    # tile of every live site, the last row and column closed on the far side
+    nx, ny = tiles
+    span = np.maximum(hi - lo, 1e-300)
+    tx = np.clip(((sites[live, 0] - lo[0]) / span[0] * nx).astype(np.int64), 0, nx - 1)
+    ty = np.clip(((sites[live, 1] - lo[1]) / span[1] * ny).astype(np.int64), 0, ny - 1)
+    owner = ty * nx + tx
+    order = np.argsort(owner, kind='stable')
+    start = np.searchsorted(owner[order], np.arange(nx * ny + 1))
+
+    todo = [(live[order[start[t]:start[t + 1]]], halo) for t in range(nx * ny) if start[t + 1] > start[t]]
+    found = []
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = ProcessPoolExecutor(workers) if workers > 1 and len(todo) > 1 else None
+    try:
+        while todo:
+            jobs = [tile_job(sites, live, span_lo, span_hi, own, h, box) for own, h in todo]
+            if pool is None:
+                res = [tile_cells(*j) for j in jobs]
+            else:
+                res = list(pool.map(tile_cells, *zip(*jobs)))
+            retry = []
+            for (own, h), (rows, indptr, xy, missed) in zip(todo, res):
+                found.append((rows, indptr, xy))
+                if len(missed):
+                    retry.append((missed, h * 2))
+            todo = retry
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return stitch(found, tol)
+
+
+def tile_job(sites, live, span_lo, span_hi, own, halo, box):
+    # the sites a tile needs: its own plus everything within halo of their
+    # bounding rectangle. a side of the rectangle that already reaches past
+    # every live site (span_lo, span_hi) is open, nothing lies beyond it
+    a = sites[own].min(0) - halo
+    b = sites[own].max(0) + halo
+    near = live[(sites[live] >= a).all(1) & (sites[live] <= b).all(1)]
+    rect = (-np.inf if a[0] <= span_lo[0] else a[0], np.inf if b[0] >= span_hi[0] else b[0],
+            -np.inf if a[1] <= span_lo[1] else a[1], np.inf if b[1] >= span_hi[1] else b[1])
+    return (sites[near], near, own, box, rect)
+
+
+def tile_cells(sub, near, own, box, rect):
+    # runs in the worker: sweeps the tile's sites and returns the certified
+    # cells of its own sites as (rows, indptr, xy) and the rows it could not
+    # certify
+    v = Voronoi(sub, box)
+    v.bind()
+    v.assignLines()
+    local, indptr, xy = v.polygon_arrays()
+    rows = near[local]
+    mine = np.isin(rows, own)
+    counts = np.diff(indptr)
+    cell = np.repeat(np.arange(len(rows)), counts)
+    # each vertex's circle through the cell's site must stay inside rect
+    s = sub[local]
+    r = np.sqrt(((xy - s[cell]) ** 2).sum(1))
+    x0, x1, y0, y1 = rect
+    ok = (xy[:, 0] - r >= x0) & (xy[:, 0] + r <= x1) & (xy[:, 1] - r >= y0) & (xy[:, 1] + r <= y1)
+    good = mine & (np.bincount(cell, ~ok, len(rows)) == 0)
+    # a cell cut in pieces by a concave box is kept whole or not at all
+    good &= ~np.isin(rows, rows[~good])
+    keep = np.repeat(good, counts)
+    out_ptr = np.zeros(good.sum() + 1, dtype=np.int64)
+    np.cumsum(counts[good], out=out_ptr[1:])
+    missed = np.setdiff1d(own, rows[good])
+    return rows[good], out_ptr, xy[keep], missed
+
+
+def stitch(found, tol):
+    # joins the tiles' cells, sorted by site, merging vertices that agree to
+    # within tol. vertices are snapped to a grid of size tol; a vertex that
+    # lands by a grid line can round either way, so snapped points in
+    # neighbouring grid cells are merged too
+    rows = np.concatenate([f[0] for f in found]) if found else np.zeros(0, dtype=np.int64)
+    counts = np.concatenate([np.diff(f[1]) for f in found]) if found else np.zeros(0, dtype=np.int64)
+    xy = np.concatenate([f[2] for f in found]).reshape(-1, 2) if found else np.zeros((0, 2))
+    ptr = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=ptr[1:])
+
+    key = np.round(xy / tol)
+    uniq, first, inv = np.unique(key, axis=0, return_index=True, return_inverse=True)
+    inv = inv.reshape(-1)
+    rep = np.arange(len(uniq))
+    if len(uniq):
+        indptr, idx = SiteIndex(uniq).within(uniq, 1.5)
+        near = np.repeat(np.arange(len(uniq)), np.diff(indptr))
+        np.minimum.at(rep, near, idx)
+        while True:
+            nxt = rep[rep]
+            if (nxt == rep).all():
+                break
+            rep = nxt
+    used, vid = np.unique(rep, return_inverse=True)
+    vertices = xy[first[used]]
+    vid = vid[inv]
+
+    o = np.argsort(rows, kind='stable')
+    rows = rows[o]
+    counts = counts[o]
+    sel = np.repeat(ptr[o] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    vid = vid[sel]
+    # merged neighbours in a cell become one vertex
+    cell = np.repeat(np.arange(len(rows)), counts)
+    prev = np.roll(np.arange(len(vid)), 1)
+    ends = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(counts, out=ends[1:])
+    prev[ends[:-1][counts > 0]] = ends[1:][counts > 0] - 1
+    keep = (vid != vid[prev]) | (counts[cell] == 1)
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cell[keep], minlength=len(rows)), out=indptr[1:])
+    return vertices, rows, indptr, vid[keep].astype(np.int64)